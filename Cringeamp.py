@@ -1,19 +1,22 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
 import sys
 import subprocess
-import importlib
+import importlib.util
 import os
 
 def check_and_install_dependencies():
     packages = [
         ("pygame", "pygame"),
         ("PIL", "Pillow"),
-        ("mutagen", "mutagen")
+        ("mutagen", "mutagen"),
+        ("numpy", "numpy")
     ]
     missing = False
     for module_name, package_name in packages:
-        try:
-            importlib.import_module(module_name)
-        except ImportError:
+        # find_spec only locates the package, so the check doesn't pay for importing it.
+        if importlib.util.find_spec(module_name) is None:
             missing = True
             subprocess.check_call([sys.executable, "-m", "pip", "install", package_name])
     if missing:
@@ -21,21 +24,1946 @@ def check_and_install_dependencies():
 
 check_and_install_dependencies()
 
-import tkinter as tk
-from tkinter import filedialog, ttk
-import pygame
-import time
-import math
-from PIL import Image, ImageTk
+# The headless daemon never opens a window, so it skips Tk entirely; servers often do not have it installed.
+if "--headless" not in sys.argv:
+    import tkinter as tk
+    from tkinter import filedialog, ttk
+import bisect
+from array import array
+import queue
+import threading
+import heapq
+import socket
+import selectors
+import signal
+import stat
+
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 import re
-from mutagen import File as MutagenFile
+import io
+import json
+import base64
+import hashlib
+import sqlite3
+import functools
+import math
+import mmap
+from collections import OrderedDict, deque
+
+# pygame, numpy, Pillow and mutagen are imported where they are first needed so the window can appear
+# without waiting on them.
+pygame = None
+
+WAVEFORM_BUCKETS_PER_SECOND = 50
+WAVEFORM_DECODE_RATE = 16000
+ARTWORK_SIZE = 150
+REPLAYGAIN_REFERENCE_LUFS = -18.0
+SEEK_TABLE_INTERVAL = 0.25
+SEEK_LEAD_SECONDS = 0.1
+MUSIC_POSITION_JITTER_MS = 100
+# Deep enough for Artist/Album/Disc trees without walking a whole home folder by accident.
+DEFAULT_SCAN_DEPTH = 3
+PREFETCH_TRACK_COUNT = 3
+# Candidates a search checks per step; about a millisecond of work, so typing stays responsive on huge libraries.
+SEARCH_CHUNK_SIZE = 10000
+PREFETCH_BUDGET_MB = 256
+# The daemon usually plays from local disks, where the page cache already does the read-ahead.
+HEADLESS_PREFETCH_BUDGET_MB = 32
+MAXIMUM_DECODE_SECONDS = 30 * 60
+# What one loudness worker can hold at once: the longest track it decodes as 16-bit stereo at 44.1 kHz, one
+# chunk of FFT work and its own interpreter.
+ANALYSIS_WORKER_BYTES = MAXIMUM_DECODE_SECONDS * 44100 * 4 + 160 * 1024 * 1024
+
+# Kilobits per second by [MPEG-1][layer] or [MPEG-2/2.5][layer], indexed by the header's bitrate field.
+MPEG_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MPEG_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+ARTWORK_FILE_NAMES = ('folder.jpg', 'folder.png', 'cover.jpg', 'cover.png', 'front.jpg', 'front.png')
 
 if sys.platform == 'win32':
     import ctypes
     ctypes.windll.user32.ShowWindow(ctypes.windll.kernel32.GetConsoleWindow(), 0)
 
+def get_command_line_value(option_name, default=None):
+    # Options that take a value, such as --socket PATH, read it from the argument that follows them.
+    if option_name in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(option_name) + 1]
+    return default
+
+def get_command_line_integer(option_name, default=None):
+    option_value = get_command_line_value(option_name)
+    if option_value is None:
+        return default
+    try:
+        return int(option_value)
+    except ValueError:
+        print(f"Ignoring {option_name} {option_value}: not a whole number")
+        return default
+
+def get_cache_directory():
+    if sys.platform == 'win32':
+        base_directory = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base_directory = os.path.expanduser('~/Library/Caches')
+    else:
+        base_directory = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    cache_directory = os.path.join(base_directory, "Cringeamp")
+    os.makedirs(cache_directory, exist_ok=True)
+    return cache_directory
+
+class TimedSpan:
+    def __init__(self, recorder, name, detail, histogram_name):
+        self.recorder = recorder
+        self.name = name
+        self.detail = detail
+        self.histogram_name = histogram_name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        duration = time.perf_counter() - self.start_time
+        self.recorder.record(self.name, self.start_time, duration, self.detail)
+        if self.histogram_name is not None:
+            self.recorder.observe(self.histogram_name, duration * 1000)
+        return False
+
+class PerformanceRecorder:
+    # Opt-in timing of the hot paths, switched on with --profile. While it is off, timed() hands functions back
+    # unwrapped and wrap_scheduler() returns the scheduler itself, so the instrumentation costs nothing in release builds.
+    histogram_bounds = (1, 2, 4, 8, 16, 33, 66, 133, 266, 533, 1066)
+
+    def __init__(self, enabled, maximum_events=200000):
+        self.enabled = enabled
+        self.origin_time = time.perf_counter()
+        self.trace_events = deque(maxlen=maximum_events)
+        self.span_totals = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def timed(self, name, detail_argument=None, histogram_name=None):
+        # detail_argument picks a positional argument, usually the file path, to label each span in the trace.
+        def decorator(function):
+            if not self.enabled:
+                return function
+
+            @functools.wraps(function)
+            def timed_function(*arguments, **keyword_arguments):
+                detail = arguments[detail_argument] if detail_argument is not None and detail_argument < len(arguments) else None
+                with TimedSpan(self, name, detail, histogram_name):
+                    return function(*arguments, **keyword_arguments)
+            return timed_function
+        return decorator
+
+    def record(self, name, start_time, duration, detail=None):
+        trace_event = {
+            "name": name,
+            "ph": "X",
+            "ts": round((start_time - self.origin_time) * 1e6, 1),
+            "dur": round(duration * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if detail is not None:
+            trace_event["args"] = {"detail": detail}
+        with self.lock:
+            self.trace_events.append(trace_event)
+            totals = self.span_totals.get(name)
+            if totals is None:
+                totals = self.span_totals[name] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += duration
+            totals[2] = max(totals[2], duration)
+
+    def observe(self, histogram_name, milliseconds):
+        with self.lock:
+            histogram = self.histograms.get(histogram_name)
+            if histogram is None:
+                histogram = self.histograms[histogram_name] = [[0] * (len(self.histogram_bounds) + 1), 0, 0.0, 0.0]
+            histogram[0][bisect.bisect_left(self.histogram_bounds, milliseconds)] += 1
+            histogram[1] += 1
+            histogram[2] += milliseconds
+            histogram[3] = max(histogram[3], milliseconds)
+
+    def percentile(self, bucket_counts, total_count, fraction):
+        # Reported as the upper edge of the bucket the percentile falls in.
+        running_count = 0
+        for bucket_index, bucket_count in enumerate(bucket_counts):
+            running_count += bucket_count
+            if running_count >= total_count * fraction:
+                return self.histogram_bounds[bucket_index] if bucket_index < len(self.histogram_bounds) else float('inf')
+        return float('inf')
+
+    def wrap_scheduler(self, scheduler):
+        return InstrumentedScheduler(scheduler, self) if self.enabled else scheduler
+
+    def summary_lines(self, span_count=8):
+        with self.lock:
+            histograms = {name: (list(histogram[0]), histogram[1], histogram[2], histogram[3])
+                          for name, histogram in self.histograms.items()}
+            span_totals = sorted(((totals[1], name, totals[0], totals[2]) for name, totals in self.span_totals.items()),
+                                 reverse=True)
+        summary_lines = []
+        for histogram_name, (bucket_counts, total_count, total_milliseconds, maximum_milliseconds) in sorted(histograms.items()):
+            summary_lines.append(
+                f"{histogram_name}: n={total_count} mean={total_milliseconds / total_count:.1f}ms "
+                f"p50<={self.percentile(bucket_counts, total_count, 0.5)}ms "
+                f"p95<={self.percentile(bucket_counts, total_count, 0.95)}ms max={maximum_milliseconds:.1f}ms"
+            )
+        for total_seconds, name, call_count, maximum_seconds in span_totals[:span_count]:
+            summary_lines.append(f"{name}: {call_count}x {total_seconds * 1000:.0f}ms total, "
+                                 f"{total_seconds / call_count * 1000:.2f}ms avg, {maximum_seconds * 1000:.1f}ms max")
+        return summary_lines
+
+    def export_trace(self, output_path=None):
+        # Chrome trace event format, which chrome://tracing and Perfetto open directly.
+        if output_path is None:
+            output_path = os.path.join(get_cache_directory(), time.strftime("trace-%Y%m%d-%H%M%S.json"))
+        with self.lock:
+            trace_events = list(self.trace_events)
+            histograms = {name: {"bounds_ms": list(self.histogram_bounds), "counts": histogram[0], "count": histogram[1],
+                                 "total_ms": histogram[2], "max_ms": histogram[3]}
+                          for name, histogram in self.histograms.items()}
+        with open(output_path, 'w') as trace_file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms", "otherData": {"histograms": histograms}},
+                      trace_file)
+        print(f"Wrote performance trace to {output_path}")
+        return output_path
+
+class InstrumentedScheduler:
+    # Stands in for the Tk root or the headless loop and times every timer callback: how long after its due
+    # time it started, which is the event loop latency, and how long it ran.
+    def __init__(self, scheduler, recorder):
+        self.scheduler = scheduler
+        self.recorder = recorder
+
+    def wrap_callback(self, callback, arguments, due_time):
+        callback_name = getattr(callback, '__qualname__', repr(callback))
+
+        def timed_callback():
+            start_time = time.perf_counter()
+            self.recorder.observe("event loop latency", max(0.0, start_time - due_time) * 1000)
+            try:
+                callback(*arguments)
+            finally:
+                self.recorder.record(callback_name, start_time, time.perf_counter() - start_time)
+        return timed_callback
+
+    def after(self, delay_milliseconds, callback, *arguments):
+        due_time = time.perf_counter() + delay_milliseconds / 1000
+        return self.scheduler.after(delay_milliseconds, self.wrap_callback(callback, arguments, due_time))
+
+    def after_idle(self, callback, *arguments):
+        return self.scheduler.after_idle(self.wrap_callback(callback, arguments, time.perf_counter()))
+
+    def after_cancel(self, identifier):
+        self.scheduler.after_cancel(identifier)
+
+performance_recorder = PerformanceRecorder("--profile" in sys.argv)
+
+def walk_audio_directories(root_path, max_depth=None, audio_extensions=('.mp3', '.wav', '.ogg', '.flac')):
+    # Yields (directory, [(path, mtime, size), ...]) one directory at a time, following symlinks but never
+    # entering the same directory twice so link loops cannot recurse forever.
+    visited_directories = set()
+    pending_directories = [(root_path, 0)]
+    while pending_directories:
+        directory_path, depth = pending_directories.pop()
+        try:
+            directory_stat = os.stat(directory_path)
+        except OSError:
+            continue
+        directory_identity = (directory_stat.st_dev, directory_stat.st_ino)
+        if directory_identity in visited_directories:
+            continue
+        visited_directories.add(directory_identity)
+        file_list = []
+        subdirectory_list = []
+        try:
+            with os.scandir(directory_path) as directory_entries:
+                for directory_entry in directory_entries:
+                    try:
+                        if directory_entry.is_dir():
+                            if max_depth is None or depth < max_depth:
+                                subdirectory_list.append(directory_entry.path)
+                        elif directory_entry.name.lower().endswith(audio_extensions) and directory_entry.is_file():
+                            file_stat = directory_entry.stat()
+                            file_list.append((directory_entry.path, file_stat.st_mtime, file_stat.st_size))
+                    except OSError:
+                        continue
+        except OSError as exception_instance:
+            print(f"Error reading folder: {exception_instance}")
+            continue
+        if file_list:
+            yield directory_path, file_list
+        for subdirectory_path in sorted(subdirectory_list, reverse=True):
+            pending_directories.append((subdirectory_path, depth + 1))
+
+def init_mixer(**mixer_settings):
+    global pygame
+    if pygame is None:
+        import pygame as pygame_module
+        pygame = pygame_module
+    if not pygame.mixer.get_init():
+        pygame.mixer.init(**mixer_settings)
+
+def is_too_long_to_decode(file_path):
+    # Whole-track decodes are held in memory at about 10 MB a minute, so hour-long mixes are left alone.
+    try:
+        from mutagen import File as MutagenFile
+        audio = MutagenFile(file_path)
+        track_length = audio.info.length if audio is not None and audio.info is not None else 0
+    except Exception:
+        return False
+    return (track_length or 0) > MAXIMUM_DECODE_SECONDS
+
+def get_available_memory():
+    # Bytes of physical memory free for new work, or None where that cannot be told.
+    if sys.platform == 'win32':
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('length', ctypes.c_ulong), ('memory_load', ctypes.c_ulong)] + [
+                (field_name, ctypes.c_ulonglong) for field_name in (
+                    'total_physical', 'available_physical', 'total_page_file', 'available_page_file',
+                    'total_virtual', 'available_virtual', 'available_extended_virtual')]
+        memory_status = MemoryStatus()
+        memory_status.length = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(memory_status)):
+            return memory_status.available_physical
+        return None
+    # MemAvailable counts the page cache that can be reclaimed, which the free page count leaves out.
+    try:
+        with open('/proc/meminfo') as meminfo_file:
+            for meminfo_line in meminfo_file:
+                if meminfo_line.startswith('MemAvailable:'):
+                    return int(meminfo_line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def register_replaygain_tags():
+    # EasyID3 maps replaygain_* to RVA2 frames, but most taggers write ReplayGain into MP3s as TXXX frames.
+    from mutagen.easyid3 import EasyID3
+    if 'replaygain_txxx_track_gain' not in EasyID3.valid_keys:
+        EasyID3.RegisterTXXXKey('replaygain_txxx_lower_track_gain', 'replaygain_track_gain')
+        EasyID3.RegisterTXXXKey('replaygain_txxx_track_gain', 'REPLAYGAIN_TRACK_GAIN')
+
+def mixer_ready():
+    return pygame is not None and pygame.mixer.get_init() is not None
+
+def init_envelope_worker():
+    # The envelope only needs a few dozen buckets a second, so the worker's mixer decodes at a low mono rate,
+    # under a fifth of the memory of a full-rate stereo decode.
+    init_analysis_worker()
+    init_mixer(frequency=WAVEFORM_DECODE_RATE, channels=1)
+
+@performance_recorder.timed("decode.waveform_envelope", 0)
+def compute_waveform_envelope(file_path, buckets_per_second=None):
+    # Runs in an envelope worker process (see MusicPlayer), so the whole-track decode never adds to the
+    # player's own memory.
+    if buckets_per_second is None:
+        buckets_per_second = WAVEFORM_BUCKETS_PER_SECOND
+    import numpy as np
+    # The mixer only decodes whole tracks, so hour-long mixes are drawn without a waveform.
+    if is_too_long_to_decode(file_path):
+        return None
+    init_mixer()
+    sound_object = pygame.mixer.Sound(file_path)
+    samples = pygame.sndarray.samples(sound_object)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    sample_rate = pygame.mixer.get_init()[0]
+    bucket_size = max(1, sample_rate // buckets_per_second)
+    bucket_count = len(samples) // bucket_size
+    envelope = np.zeros(bucket_count, dtype=np.float32)
+    # Work through the PCM in chunks so the float conversion never needs a copy of the whole track.
+    chunk_buckets = 4096
+    for first_bucket in range(0, bucket_count, chunk_buckets):
+        last_bucket = min(bucket_count, first_bucket + chunk_buckets)
+        chunk = samples[first_bucket * bucket_size:last_bucket * bucket_size].astype(np.float32)
+        chunk = np.abs(chunk).max(axis=1).reshape(last_bucket - first_bucket, bucket_size)
+        envelope[first_bucket:last_bucket] = chunk.max(axis=1)
+    peak = envelope.max() if bucket_count else 0
+    if peak > 0:
+        envelope /= peak
+    return envelope
+
+def get_indexed_track_data(file_path, compute_data, load_data, store_data, data_name):
+    # Per-track data computed from the audio is kept in the library index, keyed by path, mtime and size.
+    file_stat = os.stat(file_path)
+    try:
+        library_index = LibraryIndex()
+    except (sqlite3.Error, OSError):
+        library_index = None
+    try:
+        if library_index is not None:
+            track_data = load_data(library_index, file_path, file_stat.st_mtime, file_stat.st_size)
+            if track_data is not None:
+                return track_data
+        track_data = compute_data(file_path)
+        if library_index is not None and track_data is not None:
+            # A busy index only costs the cache entry; the data itself is still good.
+            try:
+                store_data(library_index, file_path, file_stat.st_mtime, file_stat.st_size, track_data)
+            except sqlite3.Error as exception_instance:
+                print(f"Error caching {data_name}: {exception_instance}")
+        return track_data
+    finally:
+        if library_index is not None:
+            library_index.close()
+
+def get_waveform_envelope(file_path):
+    return get_indexed_track_data(file_path, compute_waveform_envelope, LibraryIndex.load_envelope,
+                                  LibraryIndex.store_envelope, "waveform")
+
+class PlaybackClock:
+    # Position comes from the mixer's own play counter, which stops while paused and restarts with each new
+    # track, so it does not drift the way wall-clock deltas do after pauses and seeks.
+    def __init__(self):
+        self.anchor_position = 0.0
+        self.anchor_music_position = 0
+
+    def start(self, position=0.0):
+        self.anchor_position = position
+        self.anchor_music_position = 0
+
+    def seek(self, position):
+        self.anchor_position = position
+        self.anchor_music_position = max(0, pygame.mixer.music.get_pos())
+
+    def position(self):
+        music_position = pygame.mixer.music.get_pos()
+        if music_position < 0:
+            return self.anchor_position
+        return self.anchor_position + max(0, music_position - self.anchor_music_position) / 1000
+
+@performance_recorder.timed("decode.seek_table", 0)
+def scan_mp3_frames(file_path, interval=None):
+    # Walks the MPEG frame headers once and records (seconds, byte offset) of a frame every `interval` seconds.
+    # Frame times are exact even for VBR files, unlike estimates from the bitrate or the 100-point Xing TOC.
+    if interval is None:
+        interval = SEEK_TABLE_INTERVAL
+    # The file is mapped rather than read, so only the pages holding frame headers are ever brought in.
+    with open(file_path, 'rb') as audio_file:
+        if os.fstat(audio_file.fileno()).st_size == 0:
+            return array('d'), array('Q')
+        with mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return walk_mp3_frames(data, interval)
+
+def walk_mp3_frames(data, interval):
+    position = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        position = 10 + ((data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f))
+        if data[5] & 0x10:
+            position += 10
+    seek_times = array('d')
+    seek_offsets = array('Q')
+    elapsed_seconds = 0.0
+    next_entry_time = 0.0
+    first_frame = True
+    data_length = len(data)
+    while position + 4 <= data_length:
+        if data[position] != 0xff or (data[position + 1] & 0xe0) != 0xe0:
+            position = data.find(b'\xff', position + 1)
+            if position < 0:
+                break
+            continue
+        version_bits = (data[position + 1] >> 3) & 0x03
+        layer_bits = (data[position + 1] >> 1) & 0x03
+        bitrate_index = data[position + 2] >> 4
+        sample_rate_index = (data[position + 2] >> 2) & 0x03
+        padding = (data[position + 2] >> 1) & 0x01
+        if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            position += 1
+            continue
+        mpeg_one = version_bits == 3
+        layer = 4 - layer_bits
+        bitrate = MPEG_BITRATES[(mpeg_one, layer)][bitrate_index] * 1000
+        sample_rate = MPEG_SAMPLE_RATES[version_bits][sample_rate_index]
+        if layer == 1:
+            frame_samples = 384
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            frame_samples = 1152 if (layer == 2 or mpeg_one) else 576
+            frame_length = frame_samples // 8 * bitrate // sample_rate + padding
+        if first_frame:
+            first_frame = False
+            # A LAME/Xing info frame carries no audio; decoders skip it, so it must not advance the clock.
+            if b'Xing' in data[position:position + frame_length] or b'Info' in data[position:position + frame_length]:
+                position += frame_length
+                continue
+        if elapsed_seconds >= next_entry_time:
+            seek_times.append(elapsed_seconds)
+            seek_offsets.append(position)
+            next_entry_time = elapsed_seconds + interval
+        elapsed_seconds += frame_samples / sample_rate
+        position += frame_length
+    return seek_times, seek_offsets
+
+def get_seek_table(file_path):
+    if not file_path.lower().endswith('.mp3'):
+        return None
+    return get_indexed_track_data(file_path, scan_mp3_frames, LibraryIndex.load_seek_table,
+                                  LibraryIndex.store_seek_table, "seek table")
+
+def get_wave_seek_view(file_path, seek_position):
+    # SDL_mixer rounds WAV seeks down to whole seconds, so instead the mixer is handed the same header followed by
+    # the sample data from the exact frame.
+    with open(file_path, 'rb') as wave_file:
+        riff_header = wave_file.read(12)
+        if riff_header[:4] != b'RIFF' or riff_header[8:12] != b'WAVE':
+            return None
+        format_chunk = None
+        while True:
+            chunk_header = wave_file.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_size = int.from_bytes(chunk_header[4:], 'little')
+            if chunk_header[:4] == b'fmt ':
+                format_chunk = chunk_header + wave_file.read(chunk_size + (chunk_size & 1))
+            elif chunk_header[:4] == b'data':
+                break
+            else:
+                wave_file.seek(chunk_size + (chunk_size & 1), io.SEEK_CUR)
+        data_offset = wave_file.tell()
+        file_size = os.fstat(wave_file.fileno()).st_size
+    if format_chunk is None or len(format_chunk) < 22:
+        return None
+    sample_rate = int.from_bytes(format_chunk[12:16], 'little')
+    block_align = int.from_bytes(format_chunk[20:22], 'little')
+    if not sample_rate or not block_align:
+        return None
+    data_size = min(chunk_size, file_size - data_offset)
+    skipped_bytes = min(int(seek_position * sample_rate) * block_align, data_size - data_size % block_align)
+    remaining_size = data_size - skipped_bytes
+    header = (b'RIFF' + (4 + len(format_chunk) + 8 + remaining_size).to_bytes(4, 'little') + b'WAVE' + format_chunk +
+              b'data' + remaining_size.to_bytes(4, 'little'))
+    return SeekView(file_path, data_offset + skipped_bytes, header)
+
+class SeekView(io.RawIOBase):
+    # Read-only view of an audio file that starts at a frame boundary, so the mixer can begin decoding there
+    # directly instead of seeking through the stream itself. An optional header is presented in front of it.
+    def __init__(self, file_path, start_offset, header=b''):
+        super().__init__()
+        self.audio_file = open(file_path, 'rb')
+        self.start_offset = start_offset
+        self.header = header
+        self.position = 0
+        self.view_size = len(header) + max(0, os.fstat(self.audio_file.fileno()).st_size - start_offset)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        read_count = 0
+        if self.position < len(self.header):
+            header_part = self.header[self.position:self.position + len(buffer)]
+            buffer[:len(header_part)] = header_part
+            read_count = len(header_part)
+        if read_count < len(buffer):
+            self.audio_file.seek(self.start_offset + self.position + read_count - len(self.header))
+            read_count += self.audio_file.readinto(memoryview(buffer)[read_count:])
+        self.position += read_count
+        return read_count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.view_size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.audio_file.close()
+        super().close()
+
+def k_weighting_power(frequencies, sample_rate):
+    # Squared magnitude of the BS.1770 K-weighting filter (high shelf followed by high pass) at each frequency,
+    # using the sample-rate independent form of the reference 48 kHz coefficients.
+    import numpy as np
+    z_inverse = np.exp(-2j * np.pi * frequencies / sample_rate)
+
+    warped_frequency = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    quality = 0.7071752369554196
+    high_gain = 10 ** (3.999843853973347 / 20)
+    band_gain = high_gain ** 0.4996667741545416
+    shelf_response = (
+        ((high_gain + band_gain * warped_frequency / quality + warped_frequency ** 2)
+         + 2 * (warped_frequency ** 2 - high_gain) * z_inverse
+         + (high_gain - band_gain * warped_frequency / quality + warped_frequency ** 2) * z_inverse ** 2)
+        / ((1 + warped_frequency / quality + warped_frequency ** 2)
+           + 2 * (warped_frequency ** 2 - 1) * z_inverse
+           + (1 - warped_frequency / quality + warped_frequency ** 2) * z_inverse ** 2)
+    )
+
+    warped_frequency = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    quality = 0.5003270373238773
+    high_pass_response = (
+        (1 - 2 * z_inverse + z_inverse ** 2)
+        / ((1 + warped_frequency / quality + warped_frequency ** 2)
+           + 2 * (warped_frequency ** 2 - 1) * z_inverse
+           + (1 - warped_frequency / quality + warped_frequency ** 2) * z_inverse ** 2)
+    )
+    return np.abs(shelf_response * high_pass_response) ** 2
+
+def measure_loudness_gain(file_path):
+    # Integrated loudness per BS.1770 with the filtering done in the frequency domain: each 100 ms block is
+    # FFT'd and its K-weighted power summed, and the 400 ms gating blocks (75% overlap) are means of four of them.
+    import numpy as np
+    if is_too_long_to_decode(file_path):
+        return None
+    init_mixer()
+    sound_object = pygame.mixer.Sound(file_path)
+    samples = pygame.sndarray.samples(sound_object)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    sample_rate = pygame.mixer.get_init()[0]
+    full_scale = 1.0 if samples.dtype.kind == 'f' else float(np.iinfo(samples.dtype).max + 1)
+    block_size = sample_rate // 10
+    block_count = len(samples) // block_size
+    if block_count < 4:
+        return None
+    weighting = k_weighting_power(np.fft.rfftfreq(block_size, 1 / sample_rate), sample_rate)
+    # One-sided spectrum: every bin except DC (and Nyquist for even sizes) stands for two.
+    weighting[1:] *= 2
+    if block_size % 2 == 0:
+        weighting[-1] /= 2
+    block_powers = np.empty(block_count)
+    chunk_blocks = 600
+    for first_block in range(0, block_count, chunk_blocks):
+        last_block = min(block_count, first_block + chunk_blocks)
+        chunk = samples[first_block * block_size:last_block * block_size].astype(np.float32) / full_scale
+        chunk = chunk.reshape(last_block - first_block, block_size, samples.shape[1])
+        spectrum_power = np.abs(np.fft.rfft(chunk, axis=1)) ** 2
+        channel_powers = (spectrum_power * weighting[np.newaxis, :, np.newaxis]).sum(axis=1) / block_size ** 2
+        block_powers[first_block:last_block] = channel_powers.sum(axis=1)
+    gating_powers = np.convolve(block_powers, np.ones(4) / 4, mode='valid')
+    block_loudness = -0.691 + 10 * np.log10(np.maximum(gating_powers, 1e-12))
+    above_absolute_gate = block_loudness > -70
+    if not above_absolute_gate.any():
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gating_powers[above_absolute_gate].mean()) - 10
+    gated_powers = gating_powers[above_absolute_gate & (block_loudness > relative_gate)]
+    integrated_loudness = -0.691 + 10 * np.log10(gated_powers.mean())
+    return float(REPLAYGAIN_REFERENCE_LUFS - integrated_loudness)
+
+def init_analysis_worker():
+    # Analysis processes only decode audio, so keep them off the real sound device.
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+def analyse_track(file_path):
+    try:
+        return file_path, measure_loudness_gain(file_path)
+    except Exception as exception_instance:
+        print(f"Error analysing {file_path}: {exception_instance}")
+        return file_path, None
+
+def read_embedded_artwork(file_path):
+    from mutagen import File as MutagenFile
+    audio = MutagenFile(file_path)
+    if audio is None:
+        return None
+    # FLAC keeps pictures in their own metadata blocks, MP3/WAV in ID3 APIC frames and Ogg in base64 comments.
+    pictures = list(getattr(audio, 'pictures', None) or [])
+    tags = audio.tags
+    if not pictures and tags is not None:
+        if hasattr(tags, 'getall'):
+            pictures = tags.getall('APIC')
+        elif 'metadata_block_picture' in tags:
+            from mutagen.flac import Picture
+            for encoded_picture in tags['metadata_block_picture']:
+                try:
+                    pictures.append(Picture(base64.b64decode(encoded_picture)))
+                except Exception:
+                    continue
+    if not pictures:
+        return None
+    front_cover = min(pictures, key=lambda picture: picture.type != 3)
+    return front_cover.data
+
+class ArtworkCache:
+    # Cover thumbnails as PNG bytes, keyed by a hash of the original image so albums sharing a cover share an
+    # entry. The in-memory side is an LRU bounded by size; every thumbnail is also kept on disk.
+    def __init__(self, maximum_bytes=16 * 1024 * 1024):
+        self.maximum_bytes = maximum_bytes
+        self.current_bytes = 0
+        self.thumbnails = OrderedDict()
+        self.path_hashes = {}
+        self.lock = threading.Lock()
+
+    @performance_recorder.timed("artwork.load", 1)
+    def load(self, file_path):
+        with self.lock:
+            content_hash = self.path_hashes.get(file_path)
+            if content_hash is not None and content_hash in self.thumbnails:
+                self.thumbnails.move_to_end(content_hash)
+                return content_hash, self.thumbnails[content_hash]
+        image_data = None
+        try:
+            image_data = read_embedded_artwork(file_path)
+        except Exception:
+            pass
+        if image_data is None:
+            directory_path = os.path.dirname(file_path)
+            for artwork_name in ARTWORK_FILE_NAMES:
+                artwork_path = os.path.join(directory_path, artwork_name)
+                if os.path.isfile(artwork_path):
+                    with open(artwork_path, 'rb') as artwork_file:
+                        image_data = artwork_file.read()
+                    break
+        if image_data is None:
+            return None
+        content_hash = hashlib.sha1(image_data).hexdigest()
+        with self.lock:
+            self.path_hashes[file_path] = content_hash
+            if content_hash in self.thumbnails:
+                self.thumbnails.move_to_end(content_hash)
+                return content_hash, self.thumbnails[content_hash]
+        thumbnail_data = self.load_thumbnail(content_hash, image_data)
+        with self.lock:
+            if content_hash not in self.thumbnails:
+                self.thumbnails[content_hash] = thumbnail_data
+                self.current_bytes += len(thumbnail_data)
+            while self.current_bytes > self.maximum_bytes and len(self.thumbnails) > 1:
+                _, evicted_data = self.thumbnails.popitem(last=False)
+                self.current_bytes -= len(evicted_data)
+        return content_hash, thumbnail_data
+
+    def load_thumbnail(self, content_hash, image_data):
+        try:
+            artwork_directory = os.path.join(get_cache_directory(), "artwork")
+            os.makedirs(artwork_directory, exist_ok=True)
+            thumbnail_path = os.path.join(artwork_directory, content_hash + ".png")
+        except OSError:
+            thumbnail_path = None
+        if thumbnail_path is not None and os.path.exists(thumbnail_path):
+            with open(thumbnail_path, 'rb') as thumbnail_file:
+                return thumbnail_file.read()
+        from PIL import Image
+        image_object = Image.open(io.BytesIO(image_data))
+        # Let JPEG decode at a reduced scale; a 3000x3000 cover never needs to be expanded in full.
+        image_object.draft('RGB', (ARTWORK_SIZE, ARTWORK_SIZE))
+        image_object = image_object.convert("RGBA")
+        image_object.thumbnail((ARTWORK_SIZE, ARTWORK_SIZE), Image.LANCZOS)
+        padded_image = Image.new("RGBA", (ARTWORK_SIZE, ARTWORK_SIZE), (0, 0, 0, 0))
+        padded_image.paste(image_object, ((ARTWORK_SIZE - image_object.width) // 2, (ARTWORK_SIZE - image_object.height) // 2))
+        output_buffer = io.BytesIO()
+        padded_image.save(output_buffer, format="PNG")
+        thumbnail_data = output_buffer.getvalue()
+        if thumbnail_path is not None:
+            temporary_path = thumbnail_path + f".{threading.get_ident()}.tmp"
+            with open(temporary_path, 'wb') as thumbnail_file:
+                thumbnail_file.write(thumbnail_data)
+            os.replace(temporary_path, thumbnail_path)
+        return thumbnail_data
+
+class TrackPrefetcher:
+    # Reads the tracks after the current one into memory while it plays, so a track change on a slow or network
+    # mount does not wait for the disk. Buffers outside the look-ahead window are evicted first, and a track
+    # that does not fit the byte budget only gets a page cache hint instead.
+    def __init__(self, maximum_bytes=PREFETCH_BUDGET_MB * 1024 * 1024):
+        self.maximum_bytes = maximum_bytes
+        self.current_bytes = 0
+        self.buffers = OrderedDict()
+        self.pending_reads = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.hit_count = 0
+        self.miss_count = 0
+        self.seconds_saved = 0.0
+
+    def prefetch(self, file_paths):
+        wanted_paths = set(file_paths)
+        with self.lock:
+            for file_path in [file_path for file_path in self.buffers if file_path not in wanted_paths]:
+                track_data, _ = self.buffers.pop(file_path)
+                self.current_bytes -= len(track_data)
+            for file_path in [file_path for file_path in self.pending_reads if file_path not in wanted_paths]:
+                self.pending_reads.pop(file_path).cancel()
+            for file_path in file_paths:
+                if file_path not in self.buffers and file_path not in self.pending_reads:
+                    self.pending_reads[file_path] = self.executor.submit(self.read_track, file_path)
+
+    @performance_recorder.timed("prefetch.read", 1)
+    def read_track(self, file_path):
+        try:
+            read_start = time.perf_counter()
+            with open(file_path, 'rb') as track_file:
+                file_size = os.fstat(track_file.fileno()).st_size
+                with self.lock:
+                    fits_budget = self.current_bytes + file_size <= self.maximum_bytes
+                if not fits_budget:
+                    if hasattr(os, 'posix_fadvise'):
+                        os.posix_fadvise(track_file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    track_data = None
+                else:
+                    track_data = track_file.read()
+            read_seconds = time.perf_counter() - read_start
+        except OSError as exception_instance:
+            print(f"Error prefetching {file_path}: {exception_instance}")
+            track_data = None
+        with self.lock:
+            # A read that has left the look-ahead window while it ran is dropped rather than stored.
+            still_wanted = self.pending_reads.pop(file_path, None) is not None
+            if track_data is not None and still_wanted and file_path not in self.buffers:
+                self.buffers[file_path] = (track_data, read_seconds)
+                self.current_bytes += len(track_data)
+            while self.current_bytes > self.maximum_bytes and len(self.buffers) > 1:
+                _, (evicted_data, _) = self.buffers.popitem(last=False)
+                self.current_bytes -= len(evicted_data)
+
+    def open(self, file_path):
+        # Returns a file object over the prefetched bytes, or the path itself when the track was not read ahead.
+        with self.lock:
+            buffered_track = self.buffers.get(file_path)
+            if buffered_track is None:
+                self.miss_count += 1
+                return file_path
+            self.buffers.move_to_end(file_path)
+            self.hit_count += 1
+            self.seconds_saved += buffered_track[1]
+        return io.BytesIO(buffered_track[0])
+
+    def statistics(self):
+        request_count = self.hit_count + self.miss_count
+        hit_rate = self.hit_count / request_count * 100 if request_count else 0.0
+        return (f"Prefetch: {self.hit_count}/{request_count} track starts from memory ({hit_rate:.0f}%), "
+                f"{self.seconds_saved * 1000:.0f} ms of reads saved, {self.current_bytes / 1048576:.1f} MB buffered")
+
+def splice_sorted(sequence, insert_positions, new_values):
+    # Inserts each value before its position in the original sequence (positions ascending) by rewriting the
+    # tail once from the first position, rather than shifting the tail again for every value.
+    first_position = insert_positions[0]
+    merged_tail = sequence[first_position:first_position]
+    previous_position = first_position
+    for insert_position, new_value in zip(insert_positions, new_values):
+        merged_tail += sequence[previous_position:insert_position]
+        merged_tail.append(new_value)
+        previous_position = insert_position
+    merged_tail += sequence[previous_position:]
+    sequence[first_position:] = merged_tail
+
+class TrackList:
+    # Compact playlist storage: each folder path is kept once and tracks refer to it by index.
+    def __init__(self):
+        self.directories = []
+        self.directory_indices = {}
+        self.track_directories = array('I')
+        self.file_names = []
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def __getitem__(self, index):
+        return os.path.join(self.directories[self.track_directories[index]], self.file_names[index])
+
+    def insert_sorted(self, insert_positions, file_paths):
+        directory_list = []
+        file_name_list = []
+        for file_path in file_paths:
+            directory_path, file_name = os.path.split(file_path)
+            directory_index = self.directory_indices.get(directory_path)
+            if directory_index is None:
+                directory_index = len(self.directories)
+                self.directories.append(directory_path)
+                self.directory_indices[directory_path] = directory_index
+            directory_list.append(directory_index)
+            file_name_list.append(file_name)
+        splice_sorted(self.track_directories, insert_positions, directory_list)
+        splice_sorted(self.file_names, insert_positions, file_name_list)
+
+class SearchIndex:
+    # Trigram index over casefolded track titles and file names. Posting lists hold playlist indices in order.
+    # The index is built in the background from a snapshot of the playlist, and an index that is replaced
+    # before its build finishes is cancelled, so rebuilds during a scan never pile up.
+    def __init__(self, titles, file_names):
+        self.texts = None
+        self.trigrams = None
+        self.cached_results = {}
+        self.cancel_event = threading.Event()
+        threading.Thread(target=self.build, args=(titles, file_names), daemon=True).start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_ready(self):
+        return self.trigrams is not None
+
+    @performance_recorder.timed("search.build_index")
+    def build(self, titles, file_names):
+        texts = []
+        trigrams = {}
+        for track_index, (title, file_name) in enumerate(zip(titles, file_names)):
+            if track_index % 4096 == 0 and self.cancel_event.is_set():
+                return
+            text = (title + " " + file_name).casefold()
+            texts.append(text)
+            for trigram in {text[position:position + 3] for position in range(len(text) - 2)}:
+                posting_list = trigrams.get(trigram)
+                if posting_list is None:
+                    posting_list = trigrams[trigram] = array('I')
+                posting_list.append(track_index)
+        self.texts = texts
+        self.trigrams = trigrams
+
+    @performance_recorder.timed("search.query", 1)
+    def search(self, query):
+        # Only valid once the index is ready. The candidates are the smallest of the rarest trigram's posting
+        # list and the results of any cached query this one contains, so each keystroke refines earlier matches.
+        query = query.casefold()
+        if query in self.cached_results:
+            return SearchQuery(self, query, (), self.cached_results[query])
+        if len(query) >= 3:
+            candidates = min((self.trigrams.get(query[position:position + 3], ()) for position in range(len(query) - 2)),
+                             key=len)
+        else:
+            candidates = range(len(self.texts))
+        for previous_query, previous_results in self.cached_results.items():
+            if previous_query in query and len(previous_results) < len(candidates):
+                candidates = previous_results
+        return SearchQuery(self, query, candidates, array('I'))
+
+    def cache_results(self, query, results):
+        if len(self.cached_results) >= 64:
+            self.cached_results.clear()
+        self.cached_results[query] = results
+
+class SearchQuery:
+    # One query checked against its candidates a chunk at a time, so a query that matches most of a large
+    # library never holds up the next keystroke. Results fill in playlist order, so the first screen of matches
+    # is there after the first chunk, and the index caches them once every candidate has been checked.
+    def __init__(self, search_index, query, candidates, results):
+        self.search_index = search_index
+        self.query = query
+        self.candidates = candidates
+        self.results = results
+        self.position = 0
+
+    def is_complete(self):
+        return self.position >= len(self.candidates)
+
+    @performance_recorder.timed("search.filter")
+    def advance(self, candidate_count=SEARCH_CHUNK_SIZE):
+        query = self.query
+        texts = self.search_index.texts
+        candidate_chunk = self.candidates[self.position:self.position + candidate_count]
+        self.results.extend([track_index for track_index in candidate_chunk if query in texts[track_index]])
+        self.position += len(candidate_chunk)
+        if self.is_complete():
+            self.search_index.cache_results(query, self.results)
+
+class LoudnessAnalyser:
+    # Measures the tracks a scan found without a stored gain, in worker processes, and sends the gains back in
+    # batches. It outlives the scan that started it and is cancelled when another folder is opened.
+    def __init__(self, unanalysed_files, result_queue, worker_count=None):
+        self.unanalysed_files = unanalysed_files
+        self.result_queue = result_queue
+        self.worker_count = worker_count
+        self.cancel_event = threading.Event()
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        # The queued tracks are dropped here rather than by the analysis thread, so that closing the player does
+        # not leave the interpreter's exit waiting on every track still to be analysed.
+        self.cancel_event.set()
+        with self.executor_lock:
+            executor = self.executor
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_worker_count(self):
+        # Decoding and measuring is CPU bound, so it gets a process per core rather than threads, but no more
+        # processes than there is free memory for at their worst.
+        worker_count = self.worker_count or os.cpu_count() or 1
+        available_memory = get_available_memory()
+        if available_memory is not None:
+            worker_count = min(worker_count, available_memory // ANALYSIS_WORKER_BYTES)
+        return max(1, min(worker_count, len(self.unanalysed_files)))
+
+    def run(self):
+        try:
+            library_index = LibraryIndex()
+        except (sqlite3.Error, OSError) as exception_instance:
+            print(f"Error opening library index: {exception_instance}")
+            library_index = None
+        try:
+            self.analyse_files(library_index)
+        finally:
+            if library_index is not None:
+                library_index.close()
+
+    @performance_recorder.timed("scan.analyse_loudness")
+    def analyse_files(self, library_index):
+        start_time = time.time()
+        worker_count = self.get_worker_count()
+        file_information = {full_path: (modified_time, file_size, sort_key)
+                            for full_path, modified_time, file_size, sort_key in self.unanalysed_files}
+        analysed_count = 0
+        gain_batch = []
+        last_commit_time = time.time()
+        # Spawned rather than forked: forking a process that is running Tk and worker threads is not safe.
+        with self.executor_lock:
+            if self.cancel_event.is_set():
+                return
+            executor = self.executor = ProcessPoolExecutor(max_workers=worker_count, initializer=init_analysis_worker,
+                                                           mp_context=multiprocessing.get_context('spawn'))
+            pending_futures = {executor.submit(analyse_track, full_path) for full_path in file_information}
+        try:
+            while pending_futures:
+                finished_futures, pending_futures = wait(pending_futures, timeout=0.5, return_when=FIRST_COMPLETED)
+                if self.cancel_event.is_set():
+                    return
+                for future in finished_futures:
+                    full_path, track_gain = future.result()
+                    analysed_count += 1
+                    # Silent, very short, very long or unreadable files get no adjustment, and are not analysed again.
+                    if track_gain is None:
+                        track_gain = 0.0
+                    modified_time, file_size, sort_key = file_information[full_path]
+                    if library_index is not None:
+                        library_index.store_gain(full_path, modified_time, file_size, track_gain)
+                    # The sort key lets the engine find the track by bisection instead of keeping a path lookup.
+                    gain_batch.append((full_path, sort_key, track_gain))
+                if gain_batch:
+                    self.result_queue.put(("gains", gain_batch))
+                    gain_batch = []
+                if library_index is not None and time.time() - last_commit_time > 1.0:
+                    try:
+                        library_index.commit()
+                    except sqlite3.Error as exception_instance:
+                        print(f"Error saving library index: {exception_instance}")
+                    last_commit_time = time.time()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.result_queue.put(("analysed", (analysed_count, time.time() - start_time, worker_count)))
+
+class LibraryScanner:
+    audio_extensions = ('.mp3', '.wav', '.ogg', '.flac')
+
+    def __init__(self, folder_path, result_queue, max_depth=None, analyse_loudness=True, batch_size=50, worker_count=None):
+        self.folder_path = folder_path
+        self.max_depth = max_depth
+        self.analyse_loudness = analyse_loudness
+        self.result_queue = result_queue
+        self.batch_size = batch_size
+        self.worker_count = worker_count
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        start_time = time.time()
+        try:
+            library_index = LibraryIndex()
+        except (sqlite3.Error, OSError) as exception_instance:
+            print(f"Error opening library index: {exception_instance}")
+            library_index = None
+        try:
+            self.scan_folder(library_index, start_time)
+        finally:
+            if library_index is not None:
+                library_index.close()
+
+    @performance_recorder.timed("scan.folder")
+    def scan_folder(self, library_index, start_time):
+        self.unanalysed_files = []
+        self.scanned_count = 0
+        self.batch = []
+        self.last_flush_time = time.time()
+        self.last_commit_time = time.time()
+        visited_folders = set()
+        pending_futures = set()
+        maximum_pending = (self.worker_count or 8) * 4
+        executor = ThreadPoolExecutor(max_workers=self.worker_count)
+        try:
+            for directory_path, file_list in walk_audio_directories(self.folder_path, self.max_depth, self.audio_extensions):
+                if self.cancel_event.is_set():
+                    return
+                visited_folders.add(os.path.normpath(directory_path))
+                # Unchanged files come straight from the index; only new or modified files get their tags parsed.
+                indexed_records = library_index.load_folder(directory_path) if library_index is not None else {}
+                # Directory listings come in no particular order. Handing files over in track order lets most of
+                # them land at the end of the playlist, where inserting is cheap.
+                file_list.sort(key=lambda file_information: PlaybackEngine.track_sort_key(os.path.basename(file_information[0])))
+                for full_path, modified_time, file_size in file_list:
+                    record = indexed_records.pop(full_path, None)
+                    if record is not None and record['mtime'] == modified_time and record['size'] == file_size:
+                        self.queue_track(record)
+                    else:
+                        pending_futures.add(executor.submit(LibraryScanner.read_track, full_path, modified_time, file_size))
+                    # Bound the number of in-flight files so memory stays flat on huge trees.
+                    if len(pending_futures) >= maximum_pending:
+                        pending_futures = self.collect_finished(pending_futures, library_index, FIRST_COMPLETED)
+                if library_index is not None and indexed_records:
+                    library_index.remove(indexed_records.keys())
+                pending_futures = self.collect_finished(pending_futures, library_index, None)
+                self.flush_batch(force=False)
+                self.commit_index(library_index, force=False)
+            if library_index is not None:
+                library_index.remove_missing_folders(self.folder_path, visited_folders, self.max_depth)
+            while pending_futures:
+                if self.cancel_event.is_set():
+                    return
+                pending_futures = self.collect_finished(pending_futures, library_index, FIRST_COMPLETED)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.flush_batch(force=True)
+        self.commit_index(library_index, force=True)
+        # Loudness analysis is left to a LoudnessAnalyser, so the scan is over as soon as every file is listed.
+        self.result_queue.put(("done", (self.scanned_count, time.time() - start_time, self.unanalysed_files)))
+
+    def collect_finished(self, pending_futures, library_index, return_when):
+        if return_when is None:
+            finished_futures = {future for future in pending_futures if future.done()}
+            pending_futures = pending_futures - finished_futures
+        else:
+            finished_futures, pending_futures = wait(pending_futures, return_when=return_when)
+        for future in finished_futures:
+            record = future.result()
+            if library_index is not None:
+                library_index.store(record)
+            self.queue_track(record)
+        self.commit_index(library_index, force=False)
+        return pending_futures
+
+    def commit_index(self, library_index, force):
+        # Committing as the scan goes releases the write lock, so waveform and seek table caching are not locked
+        # out for the whole scan, and quitting part way through keeps everything indexed so far.
+        if library_index is None or not (force or time.time() - self.last_commit_time > 1.0):
+            return
+        try:
+            library_index.commit()
+        except sqlite3.Error as exception_instance:
+            print(f"Error saving library index: {exception_instance}")
+        self.last_commit_time = time.time()
+
+    def queue_track(self, record):
+        if self.analyse_loudness and record['gain'] is None:
+            self.unanalysed_files.append((record['path'], record['mtime'], record['size'], record['sort_key']))
+        self.batch.append(LibraryScanner.track_info(record))
+        self.scanned_count += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush_batch(force=True)
+
+    def flush_batch(self, force):
+        if self.batch and (force or time.time() - self.last_flush_time > 0.25):
+            self.result_queue.put(("tracks", self.batch))
+            self.batch = []
+            self.last_flush_time = time.time()
+
+    @staticmethod
+    def track_info(record):
+        return (record['path'], record['display_title'], record['sort_key'], record['duration'], record['gain'])
+
+    @staticmethod
+    @performance_recorder.timed("scan.read_tags", 0)
+    def read_track(full_path, modified_time=0, file_size=0):
+        file_name = os.path.basename(full_path)
+        fallback_title = os.path.splitext(file_name)[0]
+        record = {
+            'path': full_path,
+            'mtime': modified_time,
+            'size': file_size,
+            'artist': None,
+            'title': None,
+            'tracknumber': None,
+            'display_title': "▶ " + fallback_title,
+            'sort_key': PlaybackEngine.track_sort_key(file_name),
+            'duration': 0,
+            'gain': None,
+        }
+        try:
+            from mutagen import File as MutagenFile
+            register_replaygain_tags()
+            audio = MutagenFile(full_path, easy=True)
+            if audio is not None and audio.info is not None:
+                record['duration'] = audio.info.length or 0
+            record['gain'] = LibraryScanner.read_replaygain(audio)
+            if audio and 'artist' in audio and 'title' in audio and 'tracknumber' in audio:
+                artist = audio['artist'][0].strip()
+                title = audio['title'][0].strip()
+                track_string = audio['tracknumber'][0]
+                track_match = re.match(r'(\d+)', track_string)
+                if track_match:
+                    track_number = int(track_match.group(1))
+                    record['artist'] = artist
+                    record['title'] = title
+                    record['tracknumber'] = track_string
+                    record['display_title'] = "▶ " + f"{artist} - {title}"
+                    record['sort_key'] = (0, track_number, fallback_title.lower())
+        except Exception:
+            pass
+        return record
+
+    @staticmethod
+    def read_replaygain(audio, pattern=re.compile(r'\s*([-+]?\d+(?:\.\d+)?)')):
+        if not audio:
+            return None
+        for gain_key in ('replaygain_track_gain', 'replaygain_txxx_track_gain', 'replaygain_txxx_lower_track_gain'):
+            try:
+                gain_value = audio[gain_key]
+            except (KeyError, ValueError):
+                continue
+            gain_match = pattern.match(str(gain_value[0]))
+            if gain_match:
+                return float(gain_match.group(1))
+        return None
+
+class LibraryIndex:
+    schema_version = 1
+
+    def __init__(self, database_path=None):
+        if database_path is None:
+            database_path = os.path.join(get_cache_directory(), "library.sqlite3")
+        self.connection = sqlite3.connect(database_path, timeout=10)
+        # The index is only a cache, so an older layout is simply dropped and rebuilt by the next scan.
+        schema_version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version < LibraryIndex.schema_version:
+            self.connection.execute("DROP TABLE IF EXISTS tracks")
+            self.connection.execute(f"PRAGMA user_version = {LibraryIndex.schema_version}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "path TEXT PRIMARY KEY, folder TEXT NOT NULL, mtime REAL NOT NULL, size INTEGER NOT NULL, "
+            "artist TEXT, title TEXT, tracknumber TEXT, display_title TEXT NOT NULL, "
+            "sort_key TEXT NOT NULL, duration REAL NOT NULL, gain REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tracks_folder ON tracks (folder)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS envelopes ("
+            "path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, envelope BLOB NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS seek_tables ("
+            "path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, times BLOB NOT NULL, offsets BLOB NOT NULL)"
+        )
+
+    def load_folder(self, folder_path):
+        records = {}
+        cursor = self.connection.execute(
+            "SELECT path, mtime, size, artist, title, tracknumber, display_title, sort_key, duration, gain "
+            "FROM tracks WHERE folder = ?", (os.path.normpath(folder_path),)
+        )
+        for row in cursor:
+            records[row[0]] = {
+                'path': row[0],
+                'mtime': row[1],
+                'size': row[2],
+                'artist': row[3],
+                'title': row[4],
+                'tracknumber': row[5],
+                'display_title': row[6],
+                'sort_key': tuple(json.loads(row[7])),
+                'duration': row[8],
+                'gain': row[9],
+            }
+        return records
+
+    def store(self, record):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (record['path'], os.path.normpath(os.path.dirname(record['path'])), record['mtime'], record['size'],
+             record['artist'], record['title'], record['tracknumber'], record['display_title'],
+             json.dumps(record['sort_key']), record['duration'], record['gain'])
+        )
+
+    def store_gain(self, file_path, modified_time, file_size, track_gain):
+        self.connection.execute(
+            "UPDATE tracks SET gain = ? WHERE path = ? AND mtime = ? AND size = ?",
+            (track_gain, file_path, modified_time, file_size)
+        )
+
+    def remove(self, file_paths):
+        self.connection.executemany("DELETE FROM tracks WHERE path = ?", [(file_path,) for file_path in file_paths])
+        self.connection.executemany("DELETE FROM envelopes WHERE path = ?", [(file_path,) for file_path in file_paths])
+        self.connection.executemany("DELETE FROM seek_tables WHERE path = ?", [(file_path,) for file_path in file_paths])
+
+    def remove_missing_folders(self, root_path, visited_folders, max_depth=None):
+        # The walker never yields folders without audio, so rows for folders that were emptied or deleted
+        # since the last scan are only found by comparing against what the walk actually saw.
+        root_path = os.path.normpath(root_path)
+        folder_prefix = os.path.join(root_path, "")
+        indexed_folders = [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT folder FROM tracks WHERE folder = ? OR substr(folder, 1, ?) = ?",
+            (root_path, len(folder_prefix), folder_prefix)
+        )]
+        # Folders below a depth limit were not walked at all, so their rows are left alone.
+        missing_folders = [
+            folder for folder in indexed_folders
+            if folder not in visited_folders and
+            (max_depth is None or folder == root_path or os.path.relpath(folder, root_path).count(os.sep) < max_depth)
+        ]
+        for folder in missing_folders:
+            file_paths = [row[0] for row in self.connection.execute("SELECT path FROM tracks WHERE folder = ?", (folder,))]
+            self.remove(file_paths)
+        return len(missing_folders)
+
+    def load_envelope(self, file_path, modified_time, file_size):
+        row = self.connection.execute(
+            "SELECT envelope FROM envelopes WHERE path = ? AND mtime = ? AND size = ?",
+            (file_path, modified_time, file_size)
+        ).fetchone()
+        if row is None:
+            return None
+        import numpy as np
+        return np.frombuffer(row[0], dtype=np.uint8).astype(np.float32) / 255
+
+    def store_envelope(self, file_path, modified_time, file_size, envelope):
+        # Envelopes are stored as 8-bit levels, which is plenty for drawing and keeps an hour of audio under 200 KB.
+        import numpy as np
+        quantised_envelope = np.round(envelope * 255).astype(np.uint8)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO envelopes VALUES (?, ?, ?, ?)",
+            (file_path, modified_time, file_size, quantised_envelope.tobytes())
+        )
+
+    def load_seek_table(self, file_path, modified_time, file_size):
+        row = self.connection.execute(
+            "SELECT times, offsets FROM seek_tables WHERE path = ? AND mtime = ? AND size = ?",
+            (file_path, modified_time, file_size)
+        ).fetchone()
+        if row is None:
+            return None
+        seek_times = array('d')
+        seek_times.frombytes(row[0])
+        seek_offsets = array('Q')
+        seek_offsets.frombytes(row[1])
+        return seek_times, seek_offsets
+
+    def store_seek_table(self, file_path, modified_time, file_size, seek_table):
+        seek_times, seek_offsets = seek_table
+        self.connection.execute(
+            "INSERT OR REPLACE INTO seek_tables VALUES (?, ?, ?, ?, ?)",
+            (file_path, modified_time, file_size, seek_times.tobytes(), seek_offsets.tobytes())
+        )
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+class PlaybackEngine:
+    # Playback, playlist and library state with no widgets attached. The Tk window and the headless control
+    # server each drive one; `scheduler` only needs Tk's after/after_idle/after_cancel, and the callbacks tell
+    # the front end when the track, the play state or the library has changed.
+    def __init__(self, scheduler, max_depth=DEFAULT_SCAN_DEPTH, analysis_worker_count=None,
+                 prefetch_budget_mb=PREFETCH_BUDGET_MB, report_prefetch_statistics=False):
+        self.scheduler = scheduler
+        self.playlist = TrackList()
+        # Per-track state lives in sequences parallel to the playlist, so a track costs its file name, its title
+        # and a few array slots. Sort keys are not stored: they follow from the file name, plus the track number
+        # when that came from the tags (-1 otherwise).
+        self.track_titles = []
+        self.track_numbers = array('q')
+        self.track_lengths = array('f')
+        self.track_gains = array('f')
+        self.folder_groups = []
+        self.folder_group_names = {}
+        self.directory_group_keys = {}
+        self.directory_groups = []
+        self.library_folder = None
+        # Folder levels scanned below the opened folder: 0 reads only the folder itself, None has no limit.
+        self.scan_max_depth = max_depth
+        self.analysis_worker_count = analysis_worker_count
+        self.scanner = None
+        self.loudness_analyser = None
+        self.scan_queue = None
+        self.scan_after_id = None
+        self.current_index = 0
+        self.current_index_selected = False
+        # The track the mixer actually has loaded; after opening another folder it is no longer in the playlist.
+        self.current_path = None
+        self.current_title = None
+        self.current_gain = None
+        self.volume_level = 0.5
+        self.paused = False
+        self.is_seeking = False
+        self.was_playing = False
+        self.song_length = 0
+        self.normalise_loudness = True
+        self.seek_table_executor = ThreadPoolExecutor(max_workers=1)
+        self.seek_table_future = None
+        self.seek_table_path = None
+        if prefetch_budget_mb <= 0:
+            self.track_prefetcher = None
+        else:
+            self.track_prefetcher = TrackPrefetcher(prefetch_budget_mb * 1024 * 1024)
+        self.report_prefetch_statistics = report_prefetch_statistics and self.track_prefetcher is not None
+        self.playback_clock = PlaybackClock()
+        self.playback_active = False
+        self.track_offset = 0
+
+        # Variables for gapless playback of the following track
+        self.gapless_playback = True
+        self.queued_index = None
+        self.queued_path = None
+        self.old_track_queued = False
+        self.last_music_position = 0
+
+        # Variables for delayed start of playback
+        self.delayed_start_pending = False
+        self.delayed_start_identifier = None
+
+        self.track_changed_callback = None
+        self.state_changed_callback = None
+        self.library_changed_callback = None
+
+    def notify(self, callback, *arguments):
+        if callback is not None:
+            callback(*arguments)
+
+    def play_current_song(self):
+        if self.playlist:
+            self.playback_active = False
+            if self.delayed_start_pending:
+                self.scheduler.after_cancel(self.delayed_start_identifier)
+                self.delayed_start_pending = False
+                self.delayed_start_identifier = None
+
+            init_mixer()
+            self.current_index_selected = True
+            # A file the mixer cannot open is skipped, so one broken track does not stop the rest of the folder.
+            for _ in range(len(self.playlist)):
+                self.set_current_track(self.current_index)
+                try:
+                    self.load_music(pygame.mixer.music.load, self.current_path)
+                    self.song_length = self.get_track_length(self.current_path, self.current_index)
+                    break
+                except pygame.error as exception_instance:
+                    print(f"Error loading {self.current_path}: {exception_instance}")
+                    self.current_index = (self.current_index + 1) % len(self.playlist)
+            else:
+                pygame.mixer.music.stop()
+                self.current_path = None
+                self.current_title = None
+                self.paused = False
+                self.notify(self.state_changed_callback)
+                return
+            self.queued_index = None
+            self.queued_path = None
+            self.old_track_queued = False
+            self.paused = False
+            self.apply_volume()
+            self.load_seek_table(self.current_path)
+            self.track_offset = 0
+
+            # Schedule the song to start playing after a 0.2 second delay.
+            self.delayed_start_pending = True
+            self.delayed_start_identifier = self.scheduler.after(200, self.delayed_play)
+
+            self.notify(self.track_changed_callback)
+            self.notify(self.state_changed_callback)
+
+    def set_current_track(self, index):
+        self.current_index = index
+        self.current_path = self.playlist[index]
+        self.current_title = self.track_titles[index]
+        self.current_gain = None if math.isnan(self.track_gains[index]) else self.track_gains[index]
+
+    def play_index(self, index):
+        self.current_index = index
+        self.play_current_song()
+
+    def play_next(self):
+        if self.playlist:
+            self.play_index(self.get_next_index())
+
+    def get_next_index(self):
+        # Until a track is picked from a newly opened folder, whatever plays is not in the playlist, so the
+        # next track is the playlist's first.
+        if not self.current_index_selected:
+            return self.current_index
+        return (self.current_index + 1) % len(self.playlist)
+
+    @performance_recorder.timed("track.get_length", 1)
+    def get_track_length(self, file_path, track_index=None):
+        # Read the length from the container/stream headers and only decode the whole file as a last resort.
+        if track_index is not None and self.track_lengths[track_index] > 0:
+            return self.track_lengths[track_index]
+        track_length = 0
+        try:
+            from mutagen import File as MutagenFile
+            audio = MutagenFile(file_path)
+            if audio is not None and audio.info is not None:
+                track_length = audio.info.length or 0
+        except Exception:
+            pass
+        if not track_length:
+            init_mixer()
+            sound_object = pygame.mixer.Sound(file_path)
+            track_length = sound_object.get_length()
+        if track_index is not None:
+            self.track_lengths[track_index] = track_length
+        return track_length
+
+    def delayed_play(self):
+        self.delayed_start_pending = False
+        self.delayed_start_identifier = None
+        pygame.mixer.music.play()
+        # A seek made while the start was pending only moved the offset; the track starts from there.
+        if self.track_offset > 0:
+            pygame.mixer.music.set_pos(self.track_offset)
+        self.playback_clock.start(self.track_offset)
+        self.playback_active = True
+        self.last_music_position = 0
+        self.queue_next_track()
+        self.prefetch_upcoming_tracks()
+        self.notify(self.state_changed_callback)
+
+    def queue_next_track(self):
+        # Hand the next file to the mixer now so it starts the moment the current one ends, with no reload gap.
+        self.queued_index = None
+        self.queued_path = None
+        if not self.gapless_playback or not self.playlist:
+            return
+        next_index = self.get_next_index()
+        next_path = self.playlist[next_index]
+        try:
+            self.get_track_length(next_path, next_index)
+            self.load_music(pygame.mixer.music.queue, next_path)
+        except pygame.error as exception_instance:
+            print(f"Error queueing next track: {exception_instance}")
+            return
+        self.queued_index = next_index
+        self.queued_path = next_path
+        self.old_track_queued = False
+
+    @performance_recorder.timed("track.load", 2)
+    def load_music(self, load_function, file_path):
+        if self.track_prefetcher is None:
+            track_source = file_path
+        else:
+            track_source = self.track_prefetcher.open(file_path)
+        if self.report_prefetch_statistics:
+            print(self.track_prefetcher.statistics())
+        if isinstance(track_source, str):
+            load_function(track_source)
+        else:
+            load_function(track_source, os.path.splitext(file_path)[1][1:])
+
+    def prefetch_upcoming_tracks(self):
+        # Keep the current track in the window too, so a seek reload or replay does not drop its buffer.
+        if not self.playlist or self.track_prefetcher is None:
+            return
+        prefetch_count = min(PREFETCH_TRACK_COUNT, len(self.playlist) - 1)
+        self.track_prefetcher.prefetch([
+            self.playlist[(self.current_index + offset) % len(self.playlist)] for offset in range(prefetch_count + 1)
+        ])
+
+    def advance_to_queued_track(self):
+        queued_index = self.queued_index
+        queued_path = self.queued_path
+        self.queued_index = None
+        self.queued_path = None
+        if queued_index >= len(self.playlist) or self.playlist[queued_index] != queued_path:
+            # The playlist changed under the queued track, so start the track that should follow properly.
+            self.play_next()
+            return
+        # The queued track came from the playlist, so from here on the playlist follows it.
+        self.current_index_selected = True
+        self.set_current_track(queued_index)
+        self.song_length = self.get_track_length(queued_path, queued_index)
+        self.apply_volume()
+        self.track_offset = 0
+        self.playback_clock.start()
+        self.load_seek_table(queued_path)
+        self.notify(self.track_changed_callback)
+        self.queue_next_track()
+        self.prefetch_upcoming_tracks()
+
+    def update(self):
+        # Follows the mixer onto the queued track, or starts the next one when it has run out. Returns False when
+        # a new track was loaded and the caller should wait for its delayed start.
+        # get_pos restarts from zero when the mixer moves on to the queued track. Between mixer callbacks it is
+        # estimated from the wall clock, so a late callback can also step it back a little.
+        music_position = pygame.mixer.music.get_pos()
+        track_handed_over = 0 <= music_position < self.last_music_position - MUSIC_POSITION_JITTER_MS
+        if self.old_track_queued and track_handed_over:
+            # The old playlist's next track took over before the new folder had one to queue in its place.
+            self.old_track_queued = False
+            if self.playlist:
+                self.play_next()
+            else:
+                pygame.mixer.music.stop()
+                self.playback_active = False
+                self.notify(self.state_changed_callback)
+            return False
+
+        if self.queued_index is not None and track_handed_over:
+            self.advance_to_queued_track()
+            if self.delayed_start_pending:
+                return False
+            music_position = pygame.mixer.music.get_pos()
+        self.last_music_position = music_position
+        if (not pygame.mixer.music.get_busy()) and (not self.paused):
+            self.play_next()
+            return False
+        return True
+
+    def toggle_play_pause(self):
+        if self.delayed_start_pending or (not self.paused and self.is_music_busy()):
+            self.pause()
+        else:
+            self.resume()
+
+    def pause(self):
+        # If a delayed start is pending, pausing just cancels it.
+        if self.delayed_start_pending:
+            self.scheduler.after_cancel(self.delayed_start_identifier)
+            self.delayed_start_pending = False
+            self.delayed_start_identifier = None
+            self.paused = True
+            self.notify(self.state_changed_callback)
+        elif not self.paused and self.is_music_busy():
+            self.track_offset = self.get_current_time()
+            pygame.mixer.music.pause()
+            self.paused = True
+            self.notify(self.state_changed_callback)
+
+    def resume(self):
+        if self.paused and self.playback_active and mixer_ready():
+            pygame.mixer.music.unpause()
+            self.paused = False
+            self.notify(self.state_changed_callback)
+        else:
+            self.play_current_song()
+
+    def load_folder(self, folder_path):
+        self.cancel_scan()
+        self.playlist = TrackList()
+        self.track_titles = []
+        self.track_numbers = array('q')
+        self.track_lengths = array('f')
+        self.track_gains = array('f')
+        self.folder_groups = []
+        self.folder_group_names = {}
+        self.directory_group_keys = {}
+        self.directory_groups = []
+        self.library_folder = folder_path
+        # Whatever is playing keeps playing, but the new playlist starts from its first track. The mixer can only
+        # have its queued track replaced, not removed, so the old one stays until the first new track is queued.
+        self.current_index = 0
+        self.current_index_selected = False
+        self.old_track_queued = self.old_track_queued or self.queued_index is not None
+        self.queued_index = None
+        self.queued_path = None
+        self.scan_queue = queue.Queue()
+        self.scanner = LibraryScanner(folder_path, self.scan_queue, max_depth=self.scan_max_depth,
+                                      analyse_loudness=self.normalise_loudness)
+        self.scanner.start()
+        self.scan_after_id = self.scheduler.after(50, self.drain_scan_queue)
+
+    def cancel_scan(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.scanner = None
+        if self.loudness_analyser is not None:
+            self.loudness_analyser.cancel()
+            self.loudness_analyser = None
+        if self.scan_after_id:
+            self.scheduler.after_cancel(self.scan_after_id)
+            self.scan_after_id = None
+
+    def drain_scan_queue(self):
+        self.scan_after_id = None
+        scan_finished = False
+        tracks_added = False
+        # Only spend a slice of each tick on inserts so the front end stays responsive during big scans.
+        drain_deadline = time.time() + 0.03
+        try:
+            while time.time() < drain_deadline:
+                message_type, payload = self.scan_queue.get_nowait()
+                if message_type == "tracks":
+                    self.add_scanned_tracks(payload)
+                    tracks_added = True
+                elif message_type == "gains":
+                    for full_path, sort_key, track_gain in payload:
+                        track_index = self.find_track(full_path, sort_key)
+                        if track_index is not None:
+                            self.track_gains[track_index] = track_gain
+                        if full_path == self.current_path:
+                            self.current_gain = track_gain
+                            self.apply_volume()
+                elif message_type == "done":
+                    scanned_count, elapsed_seconds, unanalysed_files = payload
+                    files_per_second = scanned_count / elapsed_seconds if elapsed_seconds > 0 else float(scanned_count)
+                    print(f"Scanned {scanned_count} files in {elapsed_seconds:.2f}s ({files_per_second:.1f} files/sec)")
+                    scan_finished = True
+                    self.scanner = None
+                    if unanalysed_files:
+                        self.loudness_analyser = LoudnessAnalyser(unanalysed_files, self.scan_queue,
+                                                                  self.analysis_worker_count)
+                        self.loudness_analyser.start()
+                elif message_type == "analysed":
+                    analysed_count, elapsed_seconds, worker_count = payload
+                    tracks_per_minute = analysed_count * 60 / elapsed_seconds if elapsed_seconds > 0 else 0.0
+                    print(f"Analysed loudness of {analysed_count} tracks in {elapsed_seconds:.1f}s "
+                          f"({tracks_per_minute / worker_count:.1f} tracks/min per core)")
+                    self.loudness_analyser = None
+        except queue.Empty:
+            # A worker that died without reporting back is treated as finished.
+            if self.scanner is not None and not self.scanner.thread.is_alive() and self.scan_queue.empty():
+                scan_finished = True
+                self.scanner = None
+            if self.loudness_analyser is not None and not self.loudness_analyser.thread.is_alive() and \
+                    self.scan_queue.empty():
+                self.loudness_analyser = None
+        # Until a track is picked from the new playlist, its first track is the one to queue behind whatever plays,
+        # and that can change as more of the folder is scanned.
+        if tracks_added and self.playback_active and not self.current_index_selected and \
+                self.queued_index != self.current_index:
+            self.queue_next_track()
+        if self.scanner is not None:
+            self.scan_after_id = self.scheduler.after(50, self.drain_scan_queue)
+        elif self.loudness_analyser is not None:
+            # Gains only change the volume, and come in far slower than scan results.
+            self.scan_after_id = self.scheduler.after(1000, self.drain_scan_queue)
+        if tracks_added or scan_finished:
+            self.notify(self.library_changed_callback, tracks_added, scan_finished)
+
+    def get_group_key(self, directory_path):
+        # Tracks are ordered by their folder relative to the library root first, then by the usual track key.
+        group_key = self.directory_group_keys.get(directory_path)
+        if group_key is None:
+            relative_directory = os.path.relpath(directory_path, self.library_folder)
+            group_key = () if relative_directory == os.curdir else tuple(part.lower() for part in relative_directory.split(os.sep))
+            # Reuse one key tuple per folder rather than keeping a copy for every track.
+            if group_key in self.folder_group_names:
+                group_key = self.folder_groups[bisect.bisect_left(self.folder_groups, group_key)]
+            elif group_key:
+                bisect.insort(self.folder_groups, group_key)
+                self.folder_group_names[group_key] = relative_directory.replace(os.sep, "/")
+            self.directory_group_keys[directory_path] = group_key
+        return group_key
+
+    def get_track_group(self, track_index):
+        return self.directory_groups[self.playlist.track_directories[track_index]]
+
+    def get_track_sort_key(self, track_index):
+        file_name = self.playlist.file_names[track_index]
+        track_number = self.track_numbers[track_index]
+        if track_number < 0:
+            return PlaybackEngine.track_sort_key(file_name)
+        return (0, track_number, os.path.splitext(file_name)[0].lower())
+
+    @staticmethod
+    def bisect_tracks(is_before, low, high):
+        # First index in [low, high) for which is_before no longer holds.
+        while low < high:
+            middle = (low + high) // 2
+            if is_before(middle):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_group_range(self, group_key, low=0):
+        group_start = self.bisect_tracks(lambda track_index: self.get_track_group(track_index) < group_key, low, len(self.playlist))
+        group_end = self.bisect_tracks(lambda track_index: self.get_track_group(track_index) <= group_key, group_start, len(self.playlist))
+        return group_start, group_end
+
+    def get_group_start(self, group_key):
+        return self.get_group_range(group_key)[0]
+
+    def add_scanned_tracks(self, track_infos):
+        # Results stream in out of order from the scanner, so each batch is sorted and merged into the playlist
+        # with one pass over the tracks after its first insert point. A folder's tracks sit together, so each
+        # new track is placed by a search within its folder group.
+        new_tracks = sorted(((self.get_group_key(os.path.dirname(full_path)), tuple(sort_key), full_path, display_title,
+                              track_length, track_gain)
+                             for full_path, display_title, sort_key, track_length, track_gain in track_infos),
+                            key=lambda new_track: (new_track[0], new_track[1]))
+        if not new_tracks:
+            return
+        insert_positions = []
+        group_key = None
+        for new_group_key, sort_key, _, _, _, _ in new_tracks:
+            if new_group_key is not group_key or not insert_positions:
+                group_key = new_group_key
+                group_start, group_end = self.get_group_range(group_key, insert_positions[-1] if insert_positions else 0)
+            group_start = self.bisect_tracks(lambda track_index: self.get_track_sort_key(track_index) <= sort_key,
+                                             group_start, group_end)
+            insert_positions.append(group_start)
+        # Only follow the current track if it was picked from this playlist; until then index 0 means the first track.
+        if self.current_index_selected:
+            self.current_index += bisect.bisect_right(insert_positions, self.current_index)
+        if self.queued_index is not None:
+            self.queued_index += bisect.bisect_right(insert_positions, self.queued_index)
+        self.playlist.insert_sorted(insert_positions, [new_track[2] for new_track in new_tracks])
+        for directory_path in self.playlist.directories[len(self.directory_groups):]:
+            self.directory_groups.append(self.directory_group_keys[directory_path])
+        titles = []
+        track_numbers = []
+        for _, sort_key, full_path, display_title, _, _ in new_tracks:
+            if display_title.startswith("▶ "):
+                display_title = display_title[2:].strip()
+            titles.append(display_title)
+            # Only a number from the tags needs keeping; anything else is worked out again from the file name.
+            if sort_key[0] == 0 and sort_key != PlaybackEngine.track_sort_key(os.path.basename(full_path)):
+                track_numbers.append(min(sort_key[1], 2 ** 63 - 1))
+            else:
+                track_numbers.append(-1)
+        splice_sorted(self.track_titles, insert_positions, titles)
+        splice_sorted(self.track_numbers, insert_positions, track_numbers)
+        splice_sorted(self.track_lengths, insert_positions, [new_track[4] or 0.0 for new_track in new_tracks])
+        splice_sorted(self.track_gains, insert_positions,
+                      [math.nan if new_track[5] is None else new_track[5] for new_track in new_tracks])
+
+    def find_track(self, full_path, sort_key):
+        group_key = self.directory_group_keys.get(os.path.dirname(full_path))
+        if group_key is None:
+            return None
+        sort_key = tuple(sort_key)
+        group_start, group_end = self.get_group_range(group_key)
+        first_index = self.bisect_tracks(lambda track_index: self.get_track_sort_key(track_index) < sort_key,
+                                         group_start, group_end)
+        for track_index in range(first_index, group_end):
+            if self.playlist[track_index] == full_path:
+                return track_index
+            if self.get_track_sort_key(track_index) != sort_key:
+                break
+        return None
+
+    @staticmethod
+    def track_sort_key(file_name, pattern=re.compile(r'^\s*(\d+)')):
+        name_part, _ = os.path.splitext(file_name)
+        match = pattern.match(name_part)
+        if match:
+            number_value = int(match.group(1))
+            remaining_text = name_part[match.end():].strip().lower()
+            return (0, number_value, remaining_text)
+        else:
+            return (1, name_part.lower())
+
+    def set_volume(self, volume_level):
+        self.volume_level = volume_level
+        self.apply_volume()
+
+    def apply_volume(self):
+        if not mixer_ready():
+            return
+        volume_level = self.volume_level
+        if self.normalise_loudness and self.current_gain is not None:
+            volume_level *= 10 ** (self.current_gain / 20)
+        pygame.mixer.music.set_volume(min(1.0, volume_level))
+
+    def begin_seek(self):
+        self.is_seeking = True
+        self.was_playing = self.is_music_busy() and not self.paused
+        if self.was_playing:
+            self.track_offset = self.get_current_time()
+            pygame.mixer.music.pause()
+            self.paused = True
+            self.notify(self.state_changed_callback)
+
+    def end_seek(self, seek_position):
+        self.is_seeking = False
+        if mixer_ready():
+            seek_position = self.seek_music(seek_position)
+        self.track_offset = seek_position
+        if self.was_playing:
+            pygame.mixer.music.unpause()
+            self.paused = False
+            self.notify(self.state_changed_callback)
+        return seek_position
+
+    def seek(self, seek_position):
+        self.begin_seek()
+        return self.end_seek(max(0.0, min(seek_position, self.song_length or seek_position)))
+
+    def seek_music(self, seek_position):
+        # The mixer cannot seek a track it has not started, so delayed_play starts it from the new offset.
+        if self.delayed_start_pending:
+            return seek_position
+        seek_table = None
+        seek_view = None
+        # Reloading only makes sense for a started track; before the delayed start or after the end, set_pos is enough.
+        reload_allowed = self.playback_active and (self.was_playing or self.paused)
+        if reload_allowed and self.seek_table_future is not None and self.seek_table_future.done() and \
+                self.seek_table_path == self.current_path:
+            try:
+                seek_table = self.seek_table_future.result()
+            except Exception as exception_instance:
+                print(f"Error building seek table for {self.seek_table_path}: {exception_instance}")
+        if seek_table and seek_table[0]:
+            # Restart the decoder at a frame before the target; the table says exactly when that frame plays. A frame's
+            # data can start in the frames before it, so the first one decoded from the view is usually lost and
+            # the view has to start far enough back for that not to matter.
+            seek_times, seek_offsets = seek_table
+            entry_index = max(0, bisect.bisect_right(seek_times, seek_position - SEEK_LEAD_SECONDS) - 1)
+            seek_view = SeekView(self.seek_table_path, seek_offsets[entry_index])
+            view_start_time = seek_times[entry_index]
+            view_format = "mp3"
+        elif reload_allowed and self.current_path is not None and self.current_path.lower().endswith('.wav'):
+            try:
+                seek_view = get_wave_seek_view(self.current_path, seek_position)
+            except OSError as exception_instance:
+                print(f"Error seeking in {self.current_path}: {exception_instance}")
+            view_start_time = seek_position
+            view_format = "wav"
+        if seek_view is None:
+            pygame.mixer.music.set_pos(seek_position)
+            self.playback_clock.seek(seek_position)
+            return seek_position
+        pygame.mixer.music.load(seek_view, view_format)
+        pygame.mixer.music.play()
+        # The rest of the way is under one table interval, which the decoder covers cheaply from that frame.
+        if seek_position > view_start_time:
+            pygame.mixer.music.set_pos(seek_position - view_start_time)
+        if not self.was_playing:
+            pygame.mixer.music.pause()
+        self.playback_clock.start(seek_position)
+        self.last_music_position = 0
+        self.queue_next_track()
+        return seek_position
+
+    def load_seek_table(self, file_path):
+        if file_path == self.seek_table_path:
+            return
+        self.seek_table_path = file_path
+        if self.seek_table_future is not None:
+            self.seek_table_future.cancel()
+        self.seek_table_future = self.seek_table_executor.submit(get_seek_table, file_path)
+
+    def is_music_busy(self):
+        return mixer_ready() and pygame.mixer.music.get_busy()
+
+    def get_current_time(self):
+        if (not self.is_music_busy()) or self.paused or self.is_seeking:
+            return self.track_offset
+        else:
+            return self.playback_clock.position()
+
 class MusicPlayer:
-    def __init__(self, root):
+    def __init__(self, root, engine_options=None):
         self.root = root
         self.root.title("Cringeamp")
         self.root.geometry("400x750")
@@ -45,9 +1973,8 @@ class MusicPlayer:
             self.root.iconbitmap("images/logo.ico")
         else:
             try:
-                icon_image = Image.open("images/logo.png")
-                icon_photo = ImageTk.PhotoImage(icon_image)
-                self.root.iconphoto(True, icon_photo)
+                self.icon_photo = tk.PhotoImage(file="images/logo.png")
+                self.root.iconphoto(True, self.icon_photo)
             except Exception as exception_instance:
                 print(f"Error loading icon: {exception_instance}")
 
@@ -57,34 +1984,59 @@ class MusicPlayer:
             self.background_label.place(x=200, y=375, anchor='center')
             self.background_label.lower()
 
-        pygame.mixer.init()
-
-        self.playlist = []
-        self.track_titles = []
-        self.current_index = 0
-        self.paused = False
-        self.is_seeking = False
-        self.song_length = 0
+        self.scheduler = performance_recorder.wrap_scheduler(self.root)
+        self.engine = PlaybackEngine(self.scheduler, **(engine_options or {}))
+        self.engine.track_changed_callback = self.on_track_changed
+        self.engine.state_changed_callback = self.on_playback_state_changed
+        self.engine.library_changed_callback = self.on_library_changed
+        self.track_list_top = 0
+        self.track_list_rows = 0
+        self.selected_row = None
+        self.render_after_id = None
+        self.search_index = None
+        self.search_results = None
+        self.search_built_time = 0
+        self.search_rebuild_after_id = None
+        self.search_query = None
+        self.search_query_after_id = None
+        # Spawned like the loudness workers: forking a process that is running Tk is not safe.
+        self.envelope_executor = ProcessPoolExecutor(max_workers=1, initializer=init_envelope_worker,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        self.envelope_future = None
+        self.envelope_path = None
+        self.waveform_envelope = None
+        self.waveform_line = None
+        self.last_waveform_frame = None
+        self.artwork_cache = ArtworkCache()
+        self.artwork_executor = ThreadPoolExecutor(max_workers=1)
+        self.artwork_future = None
+        self.artwork_path = None
+        self.artwork_hash = None
+        self.artwork_image = None
         self.text_id = None
-        self.after_id = None
-        self.scrub_after_id = None
-        self.track_start_time = 0
-        self.track_offset = 0
+        self.clock_after_id = None
+        self.window_visible = True
+        self.report_startup_time = "--startup-time" in sys.argv
+        self.last_scrub_position = None
+        self.scroll_active = False
         self.scroll_direction = -1
-        self.scroll_paused = False
+        self.scroll_resume_time = 0
         self.foreground_color = '#ffffff'
+        self.debug_overlay = None
+        self.debug_overlay_after_id = None
 
         self.background_color = '#1a1a1a'
         self.semi_bg = "#0d0d0d"
 
-        # Variables for delayed start of playback
-        self.delayed_start_pending = False
-        self.delayed_start_identifier = None
-
         self.configure_styles()
         self.create_widgets()
         self.apply_theme()
-        self.animate_waveform()
+        self.root.bind("<Map>", self.on_window_map)
+        self.root.bind("<Unmap>", self.on_window_unmap)
+        if performance_recorder.enabled:
+            # Hidden unless profiling: F12 shows the timing overlay, Shift+F12 writes a trace file right away.
+            self.root.bind("<F12>", self.toggle_debug_overlay)
+            self.root.bind("<Shift-F12>", lambda event: performance_recorder.export_trace())
 
     def configure_styles(self):
         self.style = ttk.Style()
@@ -96,6 +2048,7 @@ class MusicPlayer:
         self.style.configure('Scrub.Horizontal.TScale', troughcolor='#404040', slidercolor='#ffffff', sliderwidth=15)
         self.style.configure('TLabel', font=('Helvetica', 10))
         self.style.configure('Time.TLabel', font=('Helvetica', 8))
+        self.style.configure('Search.TEntry', fieldbackground=self.semi_bg, foreground='#ffffff', insertcolor='#ffffff', borderwidth=0)
         self.root.wm_attributes('-transparent', '000000')
 
     def create_widgets(self):
@@ -105,20 +2058,34 @@ class MusicPlayer:
 
         self.waveform_canvas = tk.Canvas(self.root, bg=self.background_color, height=50, highlightthickness=0)
         self.waveform_canvas.pack(fill=tk.X, padx=20, pady=(5, 5))
+        self.waveform_canvas.bind("<Configure>", lambda event: self.draw_waveform_frame())
 
         self.current_song_canvas = tk.Canvas(self.root, bg=self.background_color, height=20, highlightthickness=0)
         self.current_song_canvas.pack(fill=tk.X, padx=20, pady=(0, 15))
 
+        self.search_variable = tk.StringVar()
+        self.search_entry = ttk.Entry(self.root, textvariable=self.search_variable, style='Search.TEntry')
+        self.search_entry.pack(fill=tk.X, padx=20, pady=(0, 5))
+        self.search_variable.trace_add('write', self.on_search_changed)
+        self.search_entry.bind("<Escape>", lambda event: self.search_variable.set(""))
+
         self.tree_frame = tk.Frame(self.root, bg=self.semi_bg)
         self.tree_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=(0, 15))
+        # The treeview only ever holds enough rows to fill the visible area; render_track_list fills them
+        # from the playlist as the view scrolls, so huge playlists cost nothing extra to display.
         self.tree = ttk.Treeview(self.tree_frame, columns=('song',), show='headings', selectmode='browse')
         self.tree.heading('song', text='TRACKS')
         self.tree.column('song', width=290, anchor=tk.W)
-        vertical_scrollbar = ttk.Scrollbar(self.tree_frame, orient="vertical", command=self.tree.yview)
-        vertical_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.tree.configure(yscrollcommand=vertical_scrollbar.set)
+        self.tree.tag_configure('group', font=('Helvetica', 10, 'bold'))
+        self.track_list_scrollbar = ttk.Scrollbar(self.tree_frame, orient="vertical", command=self.on_track_list_scroll)
+        self.track_list_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.tree.pack(fill=tk.BOTH, expand=True)
         self.tree.bind("<Double-1>", self.on_tree_double_click)
+        self.tree.bind("<<TreeviewSelect>>", self.on_track_list_select)
+        self.tree.bind("<Configure>", self.on_track_list_configure)
+        self.tree.bind("<MouseWheel>", self.on_track_list_wheel)
+        self.tree.bind("<Button-4>", self.on_track_list_wheel)
+        self.tree.bind("<Button-5>", self.on_track_list_wheel)
 
         scrub_frame = tk.Frame(self.root, bg=self.background_color)
         scrub_frame.pack(fill=tk.X, padx=20, pady=(0, 15))
@@ -149,98 +2116,328 @@ class MusicPlayer:
         self.browse_button = ttk.Button(control_frame, text="📁", command=self.load_folder)
         self.browse_button.pack(side=tk.LEFT, expand=True)
 
-    def animate_waveform(self):
-        self.waveform_canvas.delete("waveform")
+    @performance_recorder.timed("ui.draw_waveform")
+    def draw_waveform_frame(self):
         canvas_width = self.waveform_canvas.winfo_width()
         canvas_height = self.waveform_canvas.winfo_height()
         if canvas_width < 10:
-            self.root.after(50, self.animate_waveform)
             return
 
-        mid_y = canvas_height // 2
-        point_list = []
-        phase = self.get_current_time() * 5
-        maximum_amplitude = canvas_height // 3
-
-        for x_position in range(0, canvas_width, 5):
-            y_position = mid_y + (math.sin(x_position / 50 + phase) * maximum_amplitude +
-                                  math.sin(x_position / 25 + phase * 1.5) * (maximum_amplitude // 2) +
-                                  math.sin(x_position / 10 + phase * 2) * (maximum_amplitude // 3))
-            y_position = max(2, min(canvas_height - 2, y_position))
-            point_list.extend((x_position, y_position))
-
-        self.waveform_canvas.create_line(
-            point_list,
-            fill=self.foreground_color,
-            tags="waveform",
-            smooth=True,
-            width=2
-        )
-        self.root.after(50, self.animate_waveform)
+        if self.envelope_future is not None and self.envelope_future.done():
+            envelope_path = self.envelope_path
+            try:
+                self.waveform_envelope = self.envelope_future.result()
+            except Exception as exception_instance:
+                print(f"Error computing waveform for {envelope_path}: {exception_instance}")
+                self.waveform_envelope = None
+            self.envelope_future = None
+            self.last_waveform_frame = None
+
+        # The envelope is computed once per track, so each frame is just a slice of it around the play position.
+        current_time = self.engine.get_current_time()
+        waveform_frame = (canvas_width, canvas_height, current_time, self.waveform_envelope is None)
+        if waveform_frame != self.last_waveform_frame:
+            self.last_waveform_frame = waveform_frame
+            mid_y = canvas_height // 2
+            if self.waveform_envelope is not None and len(self.waveform_envelope):
+                import numpy as np
+                x_positions = np.arange(0, canvas_width, 5)
+                point_count = len(x_positions)
+                first_bucket = int(current_time * WAVEFORM_BUCKETS_PER_SECOND) - point_count // 2
+                bucket_positions = np.arange(first_bucket, first_bucket + point_count)
+                in_track = (bucket_positions >= 0) & (bucket_positions < len(self.waveform_envelope))
+                bucket_levels = self.waveform_envelope[np.clip(bucket_positions, 0, len(self.waveform_envelope) - 1)]
+                amplitudes = np.where(in_track, bucket_levels, 0) * (canvas_height // 2 - 2)
+                signs = np.where(np.arange(point_count) % 2 == 0, -1, 1)
+                y_positions = mid_y + amplitudes * signs
+                point_list = np.column_stack((x_positions, y_positions)).ravel().tolist()
+            else:
+                point_list = []
+                for x_position in range(0, canvas_width, 5):
+                    point_list.extend((x_position, mid_y))
+            if self.waveform_line is None:
+                self.waveform_line = self.waveform_canvas.create_line(
+                    point_list,
+                    fill=self.foreground_color,
+                    tags="waveform",
+                    smooth=True,
+                    width=2
+                )
+            else:
+                self.waveform_canvas.coords(self.waveform_line, point_list)
+
+    def load_waveform_envelope(self, file_path):
+        if file_path == self.envelope_path:
+            return
+        self.envelope_path = file_path
+        self.waveform_envelope = None
+        self.last_waveform_frame = None
+        if self.envelope_future is not None:
+            self.envelope_future.cancel()
+        self.envelope_future = self.envelope_executor.submit(get_waveform_envelope, file_path)
+
+    def load_artwork(self, file_path):
+        if self.artwork_future is not None:
+            self.artwork_future.cancel()
+        self.artwork_path = file_path
+        self.artwork_future = self.artwork_executor.submit(self.artwork_cache.load, file_path)
+
+    def check_artwork(self):
+        if self.artwork_future is None or not self.artwork_future.done():
+            return
+        try:
+            artwork = self.artwork_future.result()
+        except Exception as exception_instance:
+            print(f"Error loading artwork for {self.artwork_path}: {exception_instance}")
+            artwork = None
+        self.artwork_future = None
+        content_hash = artwork[0] if artwork else None
+        if content_hash == self.artwork_hash:
+            return
+        self.artwork_hash = content_hash
+        if artwork:
+            # Only the small, already-scaled PNG is turned into an image on the UI thread.
+            self.artwork_image = tk.PhotoImage(data=artwork[1])
+            self.logo_label.configure(image=self.artwork_image)
+        else:
+            self.artwork_image = None
+            self.logo_label.configure(image=self.logo_image)
 
     def update_logo_image(self):
         image_path = "images/logo.png"
-        image_object = Image.open(image_path).convert("RGBA")
         desired_width = 150
-        if image_object.width > desired_width:
-            factor = image_object.width / desired_width
-            new_width = int(image_object.width / factor)
-            new_height = int(image_object.height / factor)
-            image_object = image_object.resize((new_width, new_height), Image.LANCZOS)
-        self.logo_image = ImageTk.PhotoImage(image_object)
+        # The resized logo is kept in the cache directory so Pillow is only needed when the source image changes.
+        try:
+            scaled_path = os.path.join(get_cache_directory(), f"logo_{desired_width}.png")
+        except OSError:
+            scaled_path = None
+        if scaled_path is None or not os.path.exists(scaled_path) or os.path.getmtime(scaled_path) < os.path.getmtime(image_path):
+            from PIL import Image
+            image_object = Image.open(image_path).convert("RGBA")
+            if image_object.width > desired_width:
+                factor = image_object.width / desired_width
+                new_width = int(image_object.width / factor)
+                new_height = int(image_object.height / factor)
+                image_object = image_object.resize((new_width, new_height), Image.LANCZOS)
+            if scaled_path is not None:
+                try:
+                    image_object.save(scaled_path)
+                except OSError as exception_instance:
+                    print(f"Error caching logo: {exception_instance}")
+                    # A half-written copy would look up to date next time, so it must not be left behind.
+                    try:
+                        os.remove(scaled_path)
+                    except OSError:
+                        pass
+                    scaled_path = None
+            if scaled_path is None:
+                from PIL import ImageTk
+                self.logo_image = ImageTk.PhotoImage(image_object)
+                self.logo_label.configure(image=self.logo_image, bg=self.root.cget('bg'))
+                return
+        self.logo_image = tk.PhotoImage(file=scaled_path)
         self.logo_label.configure(image=self.logo_image, bg=self.root.cget('bg'))
 
     def format_time(self, total_seconds):
         return f"{int(total_seconds // 60):02d}:{int(total_seconds % 60):02d}"
 
     def on_tree_double_click(self, event):
+        selected_items = self.tree.selection()
+        if selected_items and self.search_rebuild_after_id is None:
+            # The tree always holds a full screen of rows, including empty ones below the last track.
+            row = self.track_list_top + self.tree.index(selected_items[0])
+            if row >= self.get_track_list_length():
+                return
+            is_group, index = self.get_track_list_row(row)
+            if is_group or index >= len(self.engine.playlist):
+                return
+            self.engine.play_index(index)
+
+    def get_track_list_row(self, row):
+        if self.search_results is not None:
+            return False, self.search_results[row]
+        # Rows are the playlist with a header row in front of every folder group. A group's header sits at
+        # its first track's index plus the number of headers before it, so the owning group is found by bisection.
+        low, high = 0, len(self.engine.folder_groups)
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_group_start(middle) + middle <= row:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return False, row
+        group_index = low - 1
+        if self.get_group_start(group_index) + group_index == row:
+            return True, group_index
+        return False, row - low
+
+    def get_group_start(self, group_index):
+        return self.engine.get_group_start(self.engine.folder_groups[group_index])
+
+    def get_track_list_length(self):
+        if self.search_results is not None:
+            return len(self.search_results)
+        return len(self.engine.playlist) + len(self.engine.folder_groups)
+
+    def on_search_changed(self, *arguments):
+        self.update_search_results()
+        self.track_list_top = 0
+        self.selected_row = None
+        self.render_track_list()
+
+    def update_search_results(self):
+        if self.search_rebuild_after_id is not None:
+            self.scheduler.after_cancel(self.search_rebuild_after_id)
+            self.search_rebuild_after_id = None
+        self.cancel_search_query()
+        query = self.search_variable.get().strip()
+        if not query:
+            self.search_results = None
+            return
+        if self.search_index is None:
+            self.build_search_index()
+        if not self.search_index.is_ready():
+            # The rows shown are held, as for stale results, until the index is there to answer the query.
+            self.search_rebuild_after_id = self.scheduler.after(50, self.rebuild_search_results)
+            return
+        self.search_query = self.search_index.search(query)
+        self.search_results = self.search_query.results
+        self.search_query.advance()
+        if not self.search_query.is_complete():
+            self.search_query_after_id = self.scheduler.after_idle(self.continue_search_query)
+
+    def continue_search_query(self):
+        self.search_query_after_id = None
+        self.search_query.advance()
+        if not self.search_query.is_complete():
+            self.search_query_after_id = self.scheduler.after_idle(self.continue_search_query)
+        self.render_track_list()
+
+    def cancel_search_query(self):
+        if self.search_query_after_id is not None:
+            self.scheduler.after_cancel(self.search_query_after_id)
+            self.search_query_after_id = None
+        self.search_query = None
+
+    def rebuild_search_results(self):
+        self.search_rebuild_after_id = None
+        self.update_search_results()
+        self.render_track_list()
+
+    def build_search_index(self):
+        # Only the snapshot is taken here; the texts and trigrams are built off the Tk thread.
+        self.search_index = SearchIndex(list(self.engine.track_titles), list(self.engine.playlist.file_names))
+        self.search_built_time = time.time()
+
+    def discard_search_index(self):
+        if self.search_index is not None:
+            self.search_index.cancel()
+            self.search_index = None
+
+    def on_track_list_configure(self, event):
+        row_height = self.style.lookup('Treeview', 'rowheight') or 20
+        visible_rows = max(1, (event.height - 25) // int(row_height))
+        if visible_rows != self.track_list_rows:
+            self.track_list_rows = visible_rows
+            existing_items = self.tree.get_children()
+            if len(existing_items) > visible_rows:
+                self.tree.delete(*existing_items[visible_rows:])
+            for _ in range(len(existing_items), visible_rows):
+                self.tree.insert('', tk.END, values=("",))
+            self.schedule_track_list_render()
+
+    def on_track_list_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            top_row = int(float(amount) * self.get_track_list_length())
+        elif unit == "pages":
+            top_row = self.track_list_top + int(amount) * self.track_list_rows
+        else:
+            top_row = self.track_list_top + int(amount)
+        self.scroll_track_list_to(top_row)
+
+    def on_track_list_wheel(self, event):
+        if event.num == 4:
+            step = -3
+        elif event.num == 5:
+            step = 3
+        else:
+            step = -3 if event.delta > 0 else 3
+        self.scroll_track_list_to(self.track_list_top + step)
+        return "break"
+
+    def scroll_track_list_to(self, top_row):
+        top_row = max(0, min(top_row, self.get_track_list_length() - self.track_list_rows))
+        if top_row != self.track_list_top:
+            self.track_list_top = top_row
+            self.render_track_list()
+
+    def on_track_list_select(self, event):
         selected_items = self.tree.selection()
         if selected_items:
-            self.current_index = self.tree.index(selected_items[0])
-            self.play_current_song()
+            self.selected_row = self.track_list_top + self.tree.index(selected_items[0])
 
-    def play_current_song(self):
-        if self.playlist:
-            # Cancel any scheduled update tasks from a previous track
-            if self.after_id:
-                self.root.after_cancel(self.after_id)
-                self.after_id = None
-            if self.scrub_after_id:
-                self.root.after_cancel(self.scrub_after_id)
-                self.scrub_after_id = None
-            if self.delayed_start_pending:
-                self.root.after_cancel(self.delayed_start_identifier)
-                self.delayed_start_pending = False
-                self.delayed_start_identifier = None
+    def schedule_track_list_render(self):
+        if self.render_after_id is None:
+            self.render_after_id = self.scheduler.after_idle(self.render_track_list)
 
-            pygame.mixer.music.load(self.playlist[self.current_index])
-            self.paused = False
-            self.play_button.config(text="⏸")
-            sound_object = pygame.mixer.Sound(self.playlist[self.current_index])
-            self.song_length = sound_object.get_length()
-            self.scrub_bar.config(to=self.song_length)
-            self.track_offset = 0
+    @performance_recorder.timed("ui.render_track_list")
+    def render_track_list(self):
+        if self.render_after_id is not None:
+            self.scheduler.after_cancel(self.render_after_id)
+            self.render_after_id = None
+        if self.search_rebuild_after_id is not None:
+            # The shown rows still match the previous results; leave them until the rebuild replaces them.
+            return
+        total_rows = self.get_track_list_length()
+        self.track_list_top = max(0, min(self.track_list_top, total_rows - self.track_list_rows))
+        selected_item = None
+        for row_offset, item in enumerate(self.tree.get_children()):
+            row = self.track_list_top + row_offset
+            if row >= total_rows:
+                self.tree.item(item, values=("",), tags=())
+                continue
+            is_group, index = self.get_track_list_row(row)
+            if is_group:
+                group_name = self.engine.folder_group_names[self.engine.folder_groups[index]]
+                self.tree.item(item, values=("📁 " + group_name,), tags=('group',))
+            else:
+                self.tree.item(item, values=("▶ " + self.engine.track_titles[index],), tags=())
+            if row == self.selected_row:
+                selected_item = item
+        if selected_item is not None:
+            self.tree.selection_set(selected_item)
+        elif self.tree.selection():
+            self.tree.selection_remove(*self.tree.selection())
+        if total_rows > 0:
+            self.track_list_scrollbar.set(self.track_list_top / total_rows,
+                                          min(1.0, (self.track_list_top + self.track_list_rows) / total_rows))
+        else:
+            self.track_list_scrollbar.set(0, 1)
 
-            # Schedule the song to start playing after a 0.2 second delay.
-            self.delayed_start_pending = True
-            self.delayed_start_identifier = self.root.after(200, self.delayed_play)
-            
-            self.update_current_song_display()
+    def on_track_changed(self):
+        file_path = self.engine.current_path
+        self.scrub_bar.config(to=self.engine.song_length)
+        self.last_scrub_position = None
+        self.load_waveform_envelope(file_path)
+        self.load_artwork(file_path)
+        self.update_current_song_display()
 
-    def delayed_play(self):
-        self.delayed_start_pending = False
-        self.delayed_start_identifier = None
-        pygame.mixer.music.play()
-        self.track_start_time = time.time()
-        self.update_scrub_bar()
+    def on_playback_state_changed(self):
+        # A stopped mixer, with nothing left to play, shows the play button just like a paused one.
+        engine = self.engine
+        playing = engine.delayed_start_pending or (engine.playback_active and not engine.paused)
+        self.play_button.config(text="⏸" if playing else "▶")
+        if playing:
+            self.wake_clock()
 
+
+    @performance_recorder.timed("ui.update_title")
     def update_current_song_display(self):
         self.current_song_canvas.delete("all")
-        if self.playlist:
-            if self.track_titles and self.current_index < len(self.track_titles):
-                song_name = self.track_titles[self.current_index]
-            else:
-                song_name = os.path.basename(self.playlist[self.current_index])
+        self.scroll_active = False
+        if self.engine.current_path is not None:
+            song_name = self.engine.current_title
             canvas_width = self.current_song_canvas.winfo_width()
             self.text_id = self.current_song_canvas.create_text(
                 canvas_width // 2, 10,
@@ -252,13 +2449,12 @@ class MusicPlayer:
             self.root.title(f"Cringeamp - {song_name}")
             self.current_song_canvas.update_idletasks()
             bounding_box = self.current_song_canvas.bbox(self.text_id)
-            if bounding_box and (bounding_box[2] - bounding_box[0] > canvas_width):
-                self.scroll_direction = -1
-                self.scroll_paused = False
-                self.animate_scroll()
+            self.scroll_active = bool(bounding_box and (bounding_box[2] - bounding_box[0] > canvas_width))
+            self.scroll_direction = -1
+            self.scroll_resume_time = 0
 
-    def animate_scroll(self):
-        if not self.text_id:
+    def step_title_scroll(self):
+        if not self.scroll_active or not self.text_id or time.time() < self.scroll_resume_time:
             return
         current_x, current_y = self.current_song_canvas.coords(self.text_id)
         bounding_box = self.current_song_canvas.bbox(self.text_id)
@@ -267,152 +2463,143 @@ class MusicPlayer:
         text_width = bounding_box[2] - bounding_box[0]
         canvas_width = self.current_song_canvas.winfo_width()
         if text_width <= canvas_width:
+            self.scroll_active = False
             return
 
-        if self.scroll_direction < 0 and current_x <= canvas_width - text_width:
-            if not self.scroll_paused:
-                self.scroll_paused = True
-                self.root.after(3000, self.resume_scroll)
-            return
-        elif self.scroll_direction > 0 and current_x >= 0:
-            if not self.scroll_paused:
-                self.scroll_paused = True
-                self.root.after(3000, self.resume_scroll)
+        # Hold at either end for three seconds, then head back the other way.
+        if (self.scroll_direction < 0 and current_x <= canvas_width - text_width) or \
+                (self.scroll_direction > 0 and current_x >= 0):
+            self.scroll_resume_time = time.time() + 3
+            self.scroll_direction = -self.scroll_direction
             return
 
         self.current_song_canvas.move(self.text_id, self.scroll_direction, 0)
-        self.after_id = self.root.after(50, self.animate_scroll)
-
-    def resume_scroll(self):
-        self.scroll_paused = False
-        self.scroll_direction = -self.scroll_direction
-        self.animate_scroll()
 
     def toggle_play_pause(self):
-        # If a delayed start is pending and the user toggles, cancel the delayed start.
-        if self.delayed_start_pending:
-            self.root.after_cancel(self.delayed_start_identifier)
-            self.delayed_start_pending = False
-            self.delayed_start_identifier = None
-            self.paused = True
-            self.play_button.config(text="▶")
-            return
-
-        if not self.paused and pygame.mixer.music.get_busy():
-            self.track_offset = self.get_current_time()
-            pygame.mixer.music.pause()
-            self.paused = True
-            self.play_button.config(text="▶")
-        else:
-            if self.paused:
-                pygame.mixer.music.unpause()
-                self.track_start_time = time.time()
-                self.paused = False
-                self.play_button.config(text="⏸")
-            else:
-                self.play_current_song()
+        self.engine.toggle_play_pause()
 
     def load_folder(self):
         folder_path = filedialog.askdirectory()
         if folder_path:
-            self.playlist = []
-            self.track_titles = []
-            self.tree.delete(*self.tree.get_children())
-            playlist_info = []
-            file_list = [file_name for file_name in os.listdir(folder_path) if file_name.lower().endswith(('.mp3', '.wav', '.ogg', '.flac'))]
-            for file_name in file_list:
-                full_path = os.path.join(folder_path, file_name)
-                fallback_title = os.path.splitext(file_name)[0]
-                display_title = "▶ " + fallback_title
-                sort_key = MusicPlayer.track_sort_key(file_name)
-                try:
-                    audio = MutagenFile(full_path, easy=True)
-                    if audio and 'artist' in audio and 'title' in audio and 'tracknumber' in audio:
-                        artist = audio['artist'][0].strip()
-                        title = audio['title'][0].strip()
-                        track_string = audio['tracknumber'][0]
-                        track_match = re.match(r'(\d+)', track_string)
-                        if track_match:
-                            track_number = int(track_match.group(1))
-                            display_title = "▶ " + f"{artist} - {title}"
-                            sort_key = (0, track_number, fallback_title.lower())
-                except Exception:
-                    pass
-                playlist_info.append((full_path, display_title, sort_key))
-            playlist_info.sort(key=lambda information: information[2])
-            for info in playlist_info:
-                self.playlist.append(info[0])
-                title_without_prefix = info[1]
-                if title_without_prefix.startswith("▶ "):
-                    title_without_prefix = title_without_prefix[2:].strip()
-                self.track_titles.append(title_without_prefix)
-                self.tree.insert('', tk.END, values=(info[1],))
+            self.engine.load_folder(folder_path)
+            self.track_list_top = 0
+            self.selected_row = None
+            self.discard_search_index()
+            self.cancel_search_query()
+            self.search_results = None
 
-    @staticmethod
-    def track_sort_key(file_name, pattern=re.compile(r'^\s*(\d+)')):
-        name_part, _ = os.path.splitext(file_name)
-        match = pattern.match(name_part)
-        if match:
-            number_value = int(match.group(1))
-            remaining_text = name_part[match.end():].strip().lower()
-            return (0, number_value, remaining_text)
-        else:
-            return (1, name_part.lower())
+            self.search_variable.set("")
+            self.render_track_list()
+
+    def on_library_changed(self, tracks_added, scan_finished):
+        if tracks_added:
+            self.discard_search_index()
+            self.cancel_search_query()
+            if self.search_results is None:
+                self.schedule_track_list_render()
+        # Indices in the search results go stale as tracks are inserted, so the results are held back from the
+        # track list and double clicks until they are rebuilt against the new playlist, at most once a second
+        # while the scan is still running.
+        if self.search_results is not None and self.search_index is None:
+            rebuild_delay = 0 if scan_finished else max(0, int((self.search_built_time + 1 - time.time()) * 1000))
+            if rebuild_delay == 0:
+                self.rebuild_search_results()
+            elif self.search_rebuild_after_id is None:
+                self.search_rebuild_after_id = self.scheduler.after(rebuild_delay, self.rebuild_search_results)
+        # Once the library is complete the index is built in the background, ready for the first keystroke.
+        if scan_finished and self.search_index is None:
+            self.build_search_index()
 
     def set_volume(self, value):
-        volume_level = float(value) / 100  # Convert to a float between 0.0 and 1.0.
-        pygame.mixer.music.set_volume(volume_level)
+        self.engine.set_volume(float(value) / 100)  # Convert to a float between 0.0 and 1.0.
 
     def start_seeking(self, event):
-        self.is_seeking = True
-        self.was_playing = pygame.mixer.music.get_busy() and not self.paused
-        if self.scrub_after_id is not None:
-            self.root.after_cancel(self.scrub_after_id)
-            self.scrub_after_id = None
-        if self.was_playing:
-            self.track_offset = self.get_current_time()
-            pygame.mixer.music.pause()
-            self.paused = True
-            self.play_button.config(text="▶")
+        self.suspend_clock()
+        self.engine.begin_seek()
 
     def stop_seeking(self, event):
-        self.is_seeking = False
-        seek_position = self.scrub_bar.get()
-        pygame.mixer.music.set_pos(seek_position)
-        self.track_offset = seek_position
-        self.track_start_time = time.time()
+        seek_position = self.engine.end_seek(self.scrub_bar.get())
+        self.last_scrub_position = seek_position
         self.time_elapsed.config(text=self.format_time(seek_position))
-        self.time_remaining.config(text=f"-{self.format_time(self.song_length - seek_position)}")
-        if self.was_playing:
-            pygame.mixer.music.unpause()
-            self.paused = False
-            self.play_button.config(text="⏸")
-        self.update_scrub_bar()
+        self.time_remaining.config(text=f"-{self.format_time(self.engine.song_length - seek_position)}")
 
     def on_scrub_drag(self, value):
-        if self.is_seeking:
+        if self.engine.is_seeking:
             current_time = float(value)
             self.time_elapsed.config(text=self.format_time(current_time))
-            self.time_remaining.config(text=f"-{self.format_time(self.song_length - current_time)}")
+            self.time_remaining.config(text=f"-{self.format_time(self.engine.song_length - current_time)}")
 
-    def get_current_time(self):
-        if (not pygame.mixer.music.get_busy()) or self.paused or self.is_seeking:
-            return self.track_offset
+    def wake_clock(self):
+        if self.clock_after_id is None:
+            self.clock_after_id = self.scheduler.after_idle(self.on_clock_tick)
+
+    def suspend_clock(self):
+        if self.clock_after_id is not None:
+            self.scheduler.after_cancel(self.clock_after_id)
+            self.clock_after_id = None
+
+    @performance_recorder.timed("ui.clock_tick", histogram_name="frame time")
+    def on_clock_tick(self):
+        # The single timer behind the scrub bar, waveform, title scroll and track changes. It stops rescheduling
+        # itself while paused, seeking or idle, and is woken again by whatever resumes playback.
+        self.clock_after_id = None
+        if self.engine.delayed_start_pending or self.engine.is_seeking or not self.engine.playback_active:
+            return
+        if not self.engine.update():
+            return
+        current_time_value = self.engine.get_current_time()
+        if self.window_visible:
+            self.check_artwork()
+            self.update_scrub_display(current_time_value)
+            self.draw_waveform_frame()
+            self.step_title_scroll()
+        if self.engine.paused:
+            return
+        if self.window_visible:
+            tick_delay = 50
         else:
-            return (time.time() - self.track_start_time) + self.track_offset
+            # Minimised: wake only often enough to notice the end of the track.
+            tick_delay = int(min(1000, max(20, (self.engine.song_length - current_time_value) * 1000 + 20)))
+        self.clock_after_id = self.scheduler.after(tick_delay, self.on_clock_tick)
 
-    def update_scrub_bar(self):
-        if (not pygame.mixer.music.get_busy()) and (not self.paused) and (not self.is_seeking):
-            self.current_index += 1
-            if self.current_index >= len(self.playlist):
-                self.current_index = 0
-            self.play_current_song()
+    def update_scrub_display(self, current_time_value):
+        if self.last_scrub_position is not None and abs(current_time_value - self.last_scrub_position) < 0.25:
             return
-        current_time_value = self.get_current_time()
+        self.last_scrub_position = current_time_value
         self.scrub_bar.set(current_time_value)
         self.time_elapsed.config(text=self.format_time(current_time_value))
-        self.time_remaining.config(text=f"-{self.format_time(self.song_length - current_time_value)}")
-        self.scrub_after_id = self.root.after(250, self.update_scrub_bar)
+        self.time_remaining.config(text=f"-{self.format_time(self.engine.song_length - current_time_value)}")
+
+    def toggle_debug_overlay(self, event=None):
+        if self.debug_overlay is not None:
+            self.root.after_cancel(self.debug_overlay_after_id)
+            self.debug_overlay.destroy()
+            self.debug_overlay = None
+            return
+        self.debug_overlay = tk.Label(self.root, justify=tk.LEFT, anchor='nw', font=('Courier', 8),
+                                      bg='#000000', fg='#00ff00', wraplength=390)
+        self.debug_overlay.place(x=0, y=0, relwidth=1.0)
+        self.update_debug_overlay()
+
+    def update_debug_overlay(self):
+        # Refreshed straight from the root rather than through the scheduler so it does not time itself.
+        summary_lines = performance_recorder.summary_lines()
+        self.debug_overlay.config(text="\n".join(summary_lines) if summary_lines else "No samples yet")
+        self.debug_overlay_after_id = self.root.after(500, self.update_debug_overlay)
+
+    def on_window_map(self, event):
+        if event.widget is self.root:
+            if self.report_startup_time:
+                self.report_startup_time = False
+                print(f"Window shown {(time.perf_counter() - STARTUP_TIME) * 1000:.0f} ms after launch")
+            self.window_visible = True
+            self.last_scrub_position = None
+            self.suspend_clock()
+            self.wake_clock()
+
+    def on_window_unmap(self, event):
+        if event.widget is self.root:
+            self.window_visible = False
 
     def apply_theme(self):
         background_color = '#1a1a1a'
@@ -426,11 +2613,259 @@ class MusicPlayer:
         self.style.configure('TButton', background=background_color, font=('Helvetica', 10), borderwidth=0)
         self.style.configure('TLabel', background=background_color, foreground=foreground_color)
         self.style.configure('Time.TLabel', background=background_color, foreground=foreground_color)
+        self.style.configure('Search.TEntry', fieldbackground=self.semi_bg, foreground=foreground_color, insertcolor=foreground_color)
         self.style.configure('Volume.Horizontal.TScale', troughcolor='#404040', slidercolor=foreground_color, sliderwidth=20, padding=5)
         self.style.configure('Scrub.Horizontal.TScale', troughcolor='#404040', slidercolor=foreground_color, sliderwidth=15)
         self.current_song_canvas.config(bg=background_color)
 
+class ControlServer:
+    # Headless front end: a PlaybackEngine run from a small timer loop, controlled over a Unix domain socket.
+    # Each request is one line of JSON such as {"command": "seek", "position": 30} and gets one line back.
+    def __init__(self, socket_path, engine_options=None):
+        self.socket_path = socket_path
+        self.timers = []
+        self.timer_callbacks = {}
+        self.next_timer_id = 0
+        self.selector = selectors.DefaultSelector()
+        self.client_buffers = {}
+        self.clock_after_id = None
+        self.scheduler = performance_recorder.wrap_scheduler(self)
+        self.engine = PlaybackEngine(self.scheduler, **(engine_options or {}))
+        self.engine.state_changed_callback = self.wake_clock
+        self.commands = {
+            "play": self.command_play,
+            "pause": self.command_pause,
+            "seek": self.command_seek,
+            "next": self.command_next,
+            "load": self.command_load,
+            "status": self.command_status,
+        }
+
+    def after(self, delay_milliseconds, callback, *arguments):
+        self.next_timer_id += 1
+        self.timer_callbacks[self.next_timer_id] = (callback, arguments)
+        heapq.heappush(self.timers, (time.monotonic() + delay_milliseconds / 1000, self.next_timer_id))
+        return self.next_timer_id
+
+    def after_idle(self, callback, *arguments):
+        return self.after(0, callback, *arguments)
+
+    def after_cancel(self, timer_id):
+        self.timer_callbacks.pop(timer_id, None)
+
+    def wake_clock(self):
+        if self.clock_after_id is None:
+            self.clock_after_id = self.scheduler.after_idle(self.on_clock_tick)
+
+    def on_clock_tick(self):
+        # With nothing to draw, the clock only has to notice track changes, so it sleeps until shortly before
+        # the current track ends and stops entirely while paused.
+        self.clock_after_id = None
+        if self.engine.delayed_start_pending or self.engine.is_seeking or not self.engine.playback_active:
+            return
+        if not self.engine.update() or self.engine.paused:
+            return
+        remaining_seconds = self.engine.song_length - self.engine.get_current_time()
+        self.clock_after_id = self.scheduler.after(int(min(1000, max(20, remaining_seconds * 1000 + 20))), self.on_clock_tick)
+
+    def remove_stale_socket(self):
+        # Only a socket left behind by a daemon that is gone is removed; anything else at the path is kept.
+        try:
+            path_mode = os.lstat(self.socket_path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(path_mode):
+            raise FileExistsError(f"{self.socket_path} exists and is not a socket")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe_socket:
+            try:
+                probe_socket.connect(self.socket_path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                pass
+            else:
+                raise FileExistsError(f"Another daemon is already listening on {self.socket_path}")
+        os.unlink(self.socket_path)
+
+    def serve_forever(self):
+        self.remove_stale_socket()
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(self.socket_path)
+        server_socket.listen()
+        server_socket.setblocking(False)
+        self.selector.register(server_socket, selectors.EVENT_READ)
+        print(f"Listening on {self.socket_path}")
+        try:
+            while True:
+                while self.timers and self.timers[0][1] not in self.timer_callbacks:
+                    heapq.heappop(self.timers)
+                # Block until the next timer is due, or indefinitely when idle, so the daemon costs no CPU at rest.
+                timeout = max(0.0, self.timers[0][0] - time.monotonic()) if self.timers else None
+                for key, _ in self.selector.select(timeout):
+                    if key.fileobj is server_socket:
+                        client_socket, _ = server_socket.accept()
+                        client_socket.setblocking(False)
+                        self.client_buffers[client_socket] = b""
+                        self.selector.register(client_socket, selectors.EVENT_READ)
+                    else:
+                        self.read_client(key.fileobj)
+                while self.timers and self.timers[0][0] <= time.monotonic():
+                    _, timer_id = heapq.heappop(self.timers)
+                    timer_callback = self.timer_callbacks.pop(timer_id, None)
+                    if timer_callback is None:
+                        continue
+                    try:
+                        timer_callback[0](*timer_callback[1])
+                    except Exception as exception_instance:
+                        # Tk reports a failing callback and carries on; the daemon has to do the same.
+                        print(f"Error in timer callback: {exception_instance!r}")
+        finally:
+            self.engine.cancel_scan()
+            self.selector.close()
+            server_socket.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def read_client(self, client_socket):
+        try:
+            received_data = client_socket.recv(65536)
+        except OSError:
+            received_data = b""
+        if not received_data:
+            self.close_client(client_socket)
+            return
+        self.client_buffers[client_socket] += received_data
+        while b"\n" in self.client_buffers[client_socket]:
+            request_line, self.client_buffers[client_socket] = self.client_buffers[client_socket].split(b"\n", 1)
+            if not request_line.strip():
+                continue
+            response = self.handle_request(request_line)
+            try:
+                client_socket.sendall(json.dumps(response).encode() + b"\n")
+            except OSError:
+                self.close_client(client_socket)
+                return
+
+    def close_client(self, client_socket):
+        self.selector.unregister(client_socket)
+        self.client_buffers.pop(client_socket, None)
+        client_socket.close()
+
+    def handle_request(self, request_line):
+        try:
+            request = json.loads(request_line)
+            command_handler = self.commands.get(request.get("command"))
+            if command_handler is None:
+                return {"ok": False, "error": f"Unknown command: {request.get('command')}"}
+            command_handler(request)
+        except KeyError as exception_instance:
+            return {"ok": False, "error": f"Missing field: {exception_instance.args[0]}"}
+        except Exception as exception_instance:
+            return {"ok": False, "error": str(exception_instance)}
+        return self.command_status(request)
+
+    def command_play(self, request):
+        if "index" in request:
+            track_index = int(request["index"])
+            if not 0 <= track_index < len(self.engine.playlist):
+                raise ValueError(f"No track at index {track_index}")
+            self.engine.play_index(track_index)
+        elif self.engine.paused or not self.engine.is_music_busy():
+            self.engine.resume()
+
+    def command_pause(self, request):
+        self.engine.pause()
+
+    def command_seek(self, request):
+        self.engine.seek(float(request["position"]))
+
+    def command_next(self, request):
+        self.engine.play_next()
+
+    def command_load(self, request):
+        folder_path = os.path.abspath(os.path.expanduser(request["folder"]))
+        if not os.path.isdir(folder_path):
+            raise ValueError(f"Not a folder: {folder_path}")
+        self.engine.load_folder(folder_path)
+
+    def command_status(self, request):
+        engine = self.engine
+        if engine.delayed_start_pending or (engine.is_music_busy() and not engine.paused):
+            playback_state = "playing"
+        elif engine.paused and engine.current_index_selected:
+            playback_state = "paused"
+        else:
+            playback_state = "stopped"
+        status = {
+            "ok": True,
+            "state": playback_state,
+            "tracks": len(engine.playlist),
+            "scanning": engine.scanner is not None,
+            "analysing": engine.loudness_analyser is not None,
+            "volume": engine.volume_level,
+        }
+        if engine.current_path is not None:
+            playing_from_playlist = engine.current_index < len(engine.playlist) and \
+                engine.playlist[engine.current_index] == engine.current_path
+            status.update({
+                "index": engine.current_index if playing_from_playlist else None,
+                "path": engine.current_path,
+                "title": engine.current_title,
+                "position": round(engine.get_current_time(), 3),
+                "length": round(engine.song_length, 3),
+            })
+        return status
+
+def get_control_socket_path():
+    runtime_directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_directory:
+        runtime_directory = get_cache_directory()
+        os.makedirs(runtime_directory, exist_ok=True)
+    return os.path.join(runtime_directory, "cringeamp.sock")
+
+def get_engine_options(headless):
+    # The engine's settings come from the command line here, at the entry point, so that an engine built by
+    # other code, such as the benchmark, never picks up that program's own arguments.
+    # --no-recursive only reads the chosen folder itself; --max-depth N stops N folder levels below it.
+    if "--no-recursive" in sys.argv:
+        max_depth = 0
+    else:
+        max_depth = get_command_line_integer("--max-depth", DEFAULT_SCAN_DEPTH)
+    if "--no-prefetch" in sys.argv:
+        prefetch_budget_mb = 0
+    else:
+        prefetch_budget_mb = get_command_line_integer(
+            "--prefetch-budget", HEADLESS_PREFETCH_BUDGET_MB if headless else PREFETCH_BUDGET_MB)
+    # A daemon shares its machine with other services, so loudness analysis gets one process unless asked.
+    return {
+        "max_depth": max_depth,
+        "analysis_worker_count": get_command_line_integer("--analysis-workers", 1 if headless else None),
+        "prefetch_budget_mb": prefetch_budget_mb,
+        "report_prefetch_statistics": "--prefetch-stats" in sys.argv,
+    }
+
 if __name__ == "__main__":
-    root_window = tk.Tk()
-    application_instance = MusicPlayer(root_window)
-    root_window.mainloop()
+    # Loudness analysis runs in spawned processes, which frozen Windows builds cannot start without this.
+    multiprocessing.freeze_support()
+    if "--headless" in sys.argv:
+        if not hasattr(socket, 'AF_UNIX'):
+            print("Headless mode needs Unix domain sockets, which this platform does not provide")
+            sys.exit(1)
+        socket_path = get_command_line_value("--socket") or get_control_socket_path()
+        control_server = ControlServer(socket_path, get_engine_options(headless=True))
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+        try:
+            control_server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        except OSError as exception_instance:
+            print(f"Cannot listen on {socket_path}: {exception_instance}")
+            sys.exit(1)
+    else:
+        root_window = tk.Tk()
+        application_instance = MusicPlayer(root_window, get_engine_options(headless=False))
+
+        root_window.mainloop()
+        application_instance.engine.cancel_scan()
+        application_instance.envelope_executor.shutdown(wait=False, cancel_futures=True)
+
+    if performance_recorder.enabled:
+        performance_recorder.export_trace(get_command_line_value("--profile-output"))
@@ -0,0 +1,776 @@
+# Reproducible benchmarks for Cringeamp: builds a synthetic, tagged music library and times folder scans,
+# playlist sorting, time to first audio and track switches through the same PlaybackEngine the player uses.
+#
+#   python benchmark.py --folders 50 --tracks 12 --save-baseline baseline.json
+#   python benchmark.py --folders 50 --tracks 12 --baseline baseline.json
+#   xvfb-run python benchmark.py --gui
+#
+# Audio goes to SDL's dummy driver unless SDL_AUDIODRIVER is already set. The seek step records what is played
+# with SDL's disk driver instead, to check where each seek really lands.
+import argparse
+import bisect
+import heapq
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+
+import Cringeamp
+
+SAMPLE_RATE = 22050
+SCAN_BATCH_SIZE = 50
+GAP_TONES = (("first", 1, 440), ("first", 2, 660), ("second", 1, 880))
+GAP_TONE_SECONDS = 1.5
+# Typed one character at a time into the search of every synthetic playlist; the smallest has artists 0000-0008.
+SEARCH_QUERY = "artist 0005"
+FLAC_BLOCK_SIZE = 4096
+# Track number tags as they turn up in real collections; the player has to cope with all of them.
+MESSY_TRACK_NUMBERS = ("{number}", "{number:02d}", "{number}/{total}", "{number:02d}/{total:02d}", " {number} ",
+                       "{number} of {total}", "A{number}", "")
+FILE_NAME_PATTERNS = ("{number:02d} - {title}", "{number:02d}. {title}", "{number} {title}", "{title}",
+                      "Disc 1 - {number:02d} {title}")
+# Lower is better for every metric, so a regression is always a ratio above 1.
+METRIC_NAMES = ("scan_cold_seconds", "scan_warm_seconds", "sort_seconds", "time_to_first_audio_seconds",
+                "track_switch_median_seconds", "track_switch_max_seconds", "peak_rss_mb")
+
+def make_crc_table(polynomial, width):
+    top_bit = 1 << (width - 1)
+    mask = (1 << width) - 1
+    crc_table = []
+    for byte_value in range(256):
+        crc_value = byte_value << (width - 8)
+        for _ in range(8):
+            crc_value = ((crc_value << 1) ^ polynomial) & mask if crc_value & top_bit else (crc_value << 1) & mask
+        crc_table.append(crc_value)
+    return crc_table
+
+CRC8_TABLE = make_crc_table(0x07, 8)
+CRC16_TABLE = make_crc_table(0x8005, 16)
+
+def crc8(data):
+    crc_value = 0
+    for byte_value in data:
+        crc_value = CRC8_TABLE[crc_value ^ byte_value]
+    return crc_value
+
+def crc16(data):
+    crc_value = 0
+    for byte_value in data:
+        crc_value = ((crc_value << 8) & 0xffff) ^ CRC16_TABLE[(crc_value >> 8) ^ byte_value]
+    return crc_value
+
+def encode_frame_number(frame_number):
+    # FLAC stores the frame number with UTF-8 style variable length coding.
+    if frame_number < 0x80:
+        return bytes([frame_number])
+    encoded_bytes = []
+    prefix_bits = 0x80
+    limit = 0x3f
+    while frame_number > limit:
+        encoded_bytes.insert(0, 0x80 | (frame_number & 0x3f))
+        frame_number >>= 6
+        prefix_bits = 0x80 | (prefix_bits >> 1)
+        limit >>= 1
+    return bytes([prefix_bits | frame_number] + encoded_bytes)
+
+def write_flac(file_path, samples):
+    # Mono 16-bit FLAC made of verbatim subframes: no compression, but a valid stream every decoder accepts.
+    stream_info = struct.pack(">HH", FLAC_BLOCK_SIZE, FLAC_BLOCK_SIZE) + b"\0" * 6
+    stream_info += ((SAMPLE_RATE << 44) | (0 << 41) | (15 << 36) | len(samples)).to_bytes(8, "big") + b"\0" * 16
+    with open(file_path, "wb") as flac_file:
+        flac_file.write(b"fLaC" + bytes([0x80]) + len(stream_info).to_bytes(3, "big") + stream_info)
+        for frame_number, block_start in enumerate(range(0, len(samples), FLAC_BLOCK_SIZE)):
+            block_samples = samples[block_start:block_start + FLAC_BLOCK_SIZE]
+            if len(block_samples) == FLAC_BLOCK_SIZE:
+                header = bytes([0xff, 0xf8, (12 << 4) | 6, 0x08]) + encode_frame_number(frame_number)
+            else:
+                header = bytes([0xff, 0xf8, (7 << 4) | 6, 0x08]) + encode_frame_number(frame_number)
+                header += struct.pack(">H", len(block_samples) - 1)
+            frame_data = header + bytes([crc8(header)]) + b"\x02" + struct.pack(f">{len(block_samples)}h", *block_samples)
+            flac_file.write(frame_data + struct.pack(">H", crc16(frame_data)))
+
+def write_wav(file_path, samples):
+    with wave.open(file_path, "wb") as wave_file:
+        wave_file.setnchannels(1)
+        wave_file.setsampwidth(2)
+        wave_file.setframerate(SAMPLE_RATE)
+        wave_file.writeframes(struct.pack(f"<{len(samples)}h", *samples))
+
+def write_mp3(file_path, samples, variable_bitrate=False):
+    import lameenc
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(64)
+    if variable_bitrate:
+        encoder.set_vbr(4)
+        encoder.set_vbr_quality(4)
+    encoder.set_in_sample_rate(SAMPLE_RATE)
+    encoder.set_channels(1)
+    encoder.set_quality(7)
+    with open(file_path, "wb") as mp3_file:
+        mp3_file.write(encoder.encode(struct.pack(f"<{len(samples)}h", *samples)) + encoder.flush())
+
+def tag_file(file_path, tags):
+    if not tags:
+        return
+    if file_path.endswith(".flac"):
+        from mutagen.flac import FLAC
+        audio = FLAC(file_path)
+        for tag_name, tag_value in tags.items():
+            audio[tag_name] = tag_value
+        audio.save()
+    elif file_path.endswith(".mp3"):
+        from mutagen.easyid3 import EasyID3
+        audio = EasyID3()
+        for tag_name, tag_value in tags.items():
+            audio[tag_name] = tag_value
+        audio.save(file_path)
+    else:
+        from mutagen.wave import WAVE
+        from mutagen.id3 import TIT2, TPE1, TRCK
+        audio = WAVE(file_path)
+        audio.add_tags()
+        frame_classes = {"title": TIT2, "artist": TPE1, "tracknumber": TRCK}
+        for tag_name, tag_value in tags.items():
+            audio.tags.add(frame_classes[tag_name](encoding=3, text=tag_value))
+        audio.save()
+
+def generate_library(library_path, folder_count, tracks_per_folder, depth, formats, track_seconds, seed):
+    # The same arguments always give the same tree, names, tags and audio.
+    random_generator = random.Random(seed)
+    writers = {"wav": write_wav, "flac": write_flac, "mp3": write_mp3}
+    file_count = 0
+    for folder_number in range(folder_count):
+        artist = f"Artist {folder_number % 7:02d}"
+        folder_parts = [f"Album {folder_number:03d}"]
+        if depth > 1:
+            folder_parts.insert(0, artist)
+        folder_parts.extend(f"CD{level}" for level in range(1, depth - 1))
+        folder_path = os.path.join(library_path, *folder_parts)
+        os.makedirs(folder_path, exist_ok=True)
+        for track_number in range(1, tracks_per_folder + 1):
+            file_format = formats[random_generator.randrange(len(formats))]
+            title = f"Song {folder_number:03d}-{random_generator.randrange(1000):03d}-{track_number}"
+            file_name = random_generator.choice(FILE_NAME_PATTERNS).format(number=track_number, title=title)
+            file_path = os.path.join(folder_path, f"{file_name}.{file_format}")
+            writers[file_format](file_path, square_wave(220 + 20 * track_number, track_seconds))
+            tags = {}
+            if random_generator.random() < 0.8:
+                tags["artist"] = artist
+                tags["title"] = title
+                track_number_text = random_generator.choice(MESSY_TRACK_NUMBERS)
+                if track_number_text:
+                    tags["tracknumber"] = track_number_text.format(number=track_number, total=tracks_per_folder)
+            tag_file(file_path, tags)
+            file_count += 1
+    return file_count
+
+def square_wave(frequency, seconds):
+    return [int(8000 * ((sample_index * frequency * 2 // SAMPLE_RATE) % 2 * 2 - 1))
+            for sample_index in range(int(seconds * SAMPLE_RATE))]
+
+def noise(seconds, seed):
+    random_generator = random.Random(seed)
+    return [max(-32768, min(32767, int(random_generator.gauss(0, 5000)))) for _ in range(int(seconds * SAMPLE_RATE))]
+
+def generate_format_corpus(corpus_path, formats, track_seconds, seed):
+    # A pair of long tones per format, for the measurements that care about what is inside a file rather than
+    # how many files there are, and a noise track per format to seek in. Noise never repeats, so a stretch of
+    # it can only match one place in the track. The MP3 one is VBR, where byte offsets say least about time.
+    writers = {"wav": write_wav, "flac": write_flac, "mp3": write_mp3}
+    seek_writers = dict(writers, mp3=lambda file_path, samples: write_mp3(file_path, samples, variable_bitrate=True))
+    seek_path = os.path.join(corpus_path, "seek")
+    os.makedirs(seek_path, exist_ok=True)
+    for file_format in formats:
+        format_path = os.path.join(corpus_path, file_format)
+        os.makedirs(format_path, exist_ok=True)
+        for track_number, frequency in ((1, 440), (2, 660)):
+            writers[file_format](os.path.join(format_path, f"{track_number:02d} - Tone {frequency}.{file_format}"),
+                                 square_wave(frequency, track_seconds))
+        seek_writers[file_format](os.path.join(seek_path, f"Noise.{file_format}"), noise(track_seconds, seed))
+        # Short tones for the gap measurement: two in one folder, then the first track of the folder opened next.
+        for folder_name, track_number, frequency in GAP_TONES:
+            gap_path = os.path.join(corpus_path, "gap", file_format, folder_name)
+            os.makedirs(gap_path, exist_ok=True)
+            writers[file_format](os.path.join(gap_path, f"{track_number:02d} - Tone {frequency}.{file_format}"),
+                                 square_wave(frequency, GAP_TONE_SECONDS))
+
+class BenchmarkScheduler:
+    # The after/after_idle/after_cancel subset of Tk the engine schedules through, run by polling.
+    def __init__(self):
+        self.timers = []
+        self.timer_callbacks = {}
+        self.next_timer_id = 0
+
+    def after(self, delay_milliseconds, callback, *arguments):
+        self.next_timer_id += 1
+        self.timer_callbacks[self.next_timer_id] = (callback, arguments)
+        heapq.heappush(self.timers, (time.perf_counter() + delay_milliseconds / 1000, self.next_timer_id))
+        return self.next_timer_id
+
+    def after_idle(self, callback, *arguments):
+        return self.after(0, callback, *arguments)
+
+    def after_cancel(self, timer_id):
+        self.timer_callbacks.pop(timer_id, None)
+
+    def update(self):
+        while self.timers and self.timers[0][0] <= time.perf_counter():
+            _, timer_id = heapq.heappop(self.timers)
+            timer_callback = self.timer_callbacks.pop(timer_id, None)
+            if timer_callback is not None:
+                timer_callback[0](*timer_callback[1])
+
+def run_until(scheduler, condition, timeout=120.0):
+    start_time = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start_time > timeout:
+            raise TimeoutError("Benchmark step did not finish in time")
+        scheduler.update()
+        time.sleep(0.001)
+    return time.perf_counter() - start_time
+
+def get_memory_status_mb(field_name):
+    try:
+        with open("/proc/self/status") as status_file:
+            for status_line in status_file:
+                if status_line.startswith(field_name + ":"):
+                    return int(status_line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def get_peak_rss_mb():
+    # VmHWM only covers this process's own memory, whereas ru_maxrss also carries the peak of the process that
+    # started it across exec.
+    peak_rss_mb = get_memory_status_mb("VmHWM")
+    if peak_rss_mb is not None:
+        return peak_rss_mb
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak_rss / (1048576 if sys.platform == "darwin" else 1024)
+
+def use_cache_directory(cache_directory):
+    Cringeamp.get_cache_directory = lambda: cache_directory
+
+def run_in_fresh_process(cache_directory, function, *arguments):
+    # Every measured step gets its own interpreter, so its peak memory is the player's and not the library
+    # generator's or an earlier step's.
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=use_cache_directory, initargs=(cache_directory,)) as executor:
+        return executor.submit(function, *arguments).result()
+
+def is_audio_started(engine):
+    return engine.playback_active and engine.is_music_busy()
+
+def decode_track_length(file_path, track_index=None):
+    # How the player used to find a track's length: decode all of it into a Sound.
+    Cringeamp.init_mixer()
+    return Cringeamp.pygame.mixer.Sound(file_path).get_length()
+
+def benchmark_track_length(format_path, length_source, repeat_count=3):
+    # Starts each track of one format with its length taken from the headers or from a full decode. The tracks
+    # are added without the scanner's durations, so every start has to look the length up itself.
+    scheduler = BenchmarkScheduler()
+    engine = Cringeamp.PlaybackEngine(scheduler)
+    engine.normalise_loudness = False
+    if length_source == "decode":
+        engine.get_track_length = decode_track_length
+    engine.library_folder = format_path
+    engine.add_scanned_tracks([(os.path.join(format_path, file_name), file_name,
+                                Cringeamp.PlaybackEngine.track_sort_key(file_name), 0, None)
+                               for file_name in sorted(os.listdir(format_path))])
+    start_times = []
+    for _ in range(repeat_count):
+        for track_index in range(len(engine.playlist)):
+            engine.track_lengths[track_index] = 0
+            engine.play_index(track_index)
+            start_times.append(run_until(scheduler, lambda: is_audio_started(engine)))
+    engine.pause()
+    metric_prefix = f"first_audio_{os.path.basename(format_path)}_{length_source}"
+    results = {f"{metric_prefix}_seconds": statistics.median(start_times)}
+    peak_rss_mb = get_peak_rss_mb()
+    if peak_rss_mb is not None:
+        results[f"{metric_prefix}_peak_rss_mb"] = peak_rss_mb
+    return results
+
+def benchmark_player(library_path, file_count, switch_count, use_gui):
+    # The generated library can be up to eight folders deep, below the player's default scan depth.
+    if use_gui:
+        scheduler = Cringeamp.tk.Tk()
+        engine = Cringeamp.MusicPlayer(scheduler, {"max_depth": None}).engine
+    else:
+        scheduler = BenchmarkScheduler()
+        engine = Cringeamp.PlaybackEngine(scheduler, max_depth=None)
+    # Loudness analysis runs on after the scan and would only measure the CPU count.
+    engine.normalise_loudness = False
+    results = {}
+
+    engine.load_folder(library_path)
+    results["scan_cold_seconds"] = run_until(scheduler, lambda: engine.scanner is None)
+    engine.load_folder(library_path)
+    results["scan_warm_seconds"] = run_until(scheduler, lambda: engine.scanner is None)
+    if len(engine.playlist) != file_count:
+        print(f"Warning: scanned {len(engine.playlist)} of {file_count} generated files")
+
+    # Both include the player's fixed 200 ms delayed start.
+    engine.play_index(0)
+    results["time_to_first_audio_seconds"] = run_until(scheduler, lambda: is_audio_started(engine))
+    switch_times = []
+    for _ in range(min(switch_count, len(engine.playlist) - 1)):
+        engine.play_next()
+        switch_times.append(run_until(scheduler, lambda: is_audio_started(engine)))
+    if switch_times:
+        results["track_switch_median_seconds"] = statistics.median(switch_times)
+        results["track_switch_max_seconds"] = max(switch_times)
+    engine.pause()
+    peak_rss_mb = get_peak_rss_mb()
+    if peak_rss_mb is not None:
+        results["peak_rss_mb"] = peak_rss_mb
+    if use_gui:
+        scheduler.destroy()
+    return results
+
+def benchmark_sort(library_path, seed):
+    track_infos = [Cringeamp.LibraryScanner.track_info(Cringeamp.LibraryScanner.read_track(full_path))
+                   for _, file_list in Cringeamp.walk_audio_directories(library_path)
+                   for full_path, _, _ in file_list]
+    random.Random(seed).shuffle(track_infos)
+    sort_engine = Cringeamp.PlaybackEngine(BenchmarkScheduler())
+    sort_engine.library_folder = library_path
+    sort_start = time.perf_counter()
+    for batch_start in range(0, len(track_infos), SCAN_BATCH_SIZE):
+        sort_engine.add_scanned_tracks(track_infos[batch_start:batch_start + SCAN_BATCH_SIZE])
+    return {"sort_seconds": time.perf_counter() - sort_start}
+
+def run_for(scheduler, seconds):
+    end_time = time.perf_counter() + seconds
+    run_until(scheduler, lambda: time.perf_counter() >= end_time)
+
+def benchmark_seek(file_path, capture_path, seek_count, seed):
+    # Seeks while paused, so the recording is silent up to the first sample played from the new position. A
+    # quarter second from there is then found in a full decode of the track by cross-correlation. Targets stay
+    # within the length the player knows, which for an MP3 without a VBR header is only an estimate.
+    os.environ["SDL_AUDIODRIVER"] = "disk"
+    os.environ["SDL_DISKAUDIOFILE"] = capture_path
+    import numpy as np
+    Cringeamp.init_mixer()
+    sample_rate, sample_format, channel_count = Cringeamp.pygame.mixer.get_init()
+    if sample_format != -16:
+        print(f"Skipping seek benchmark: the mixer plays {sample_format}-bit audio, not 16-bit")
+        return {}
+    reference = Cringeamp.pygame.sndarray.array(Cringeamp.pygame.mixer.Sound(file_path))
+    reference = reference.reshape(len(reference), -1)[:, 0].astype(np.float64)
+    segment_frames = sample_rate // 4
+    scheduler = BenchmarkScheduler()
+    engine = Cringeamp.PlaybackEngine(scheduler)
+    engine.normalise_loudness = False
+    engine.library_folder = os.path.dirname(file_path)
+    file_name = os.path.basename(file_path)
+    engine.add_scanned_tracks([(file_path, file_name, Cringeamp.PlaybackEngine.track_sort_key(file_name), 0, None)])
+    engine.play_index(0)
+    # MP3 seeks use the frame table, which is built in the background once the track starts.
+    run_until(scheduler, lambda: is_audio_started(engine) and engine.seek_table_future.done())
+    random_generator = random.Random(seed)
+    seek_times = []
+    seek_errors = []
+    for _ in range(seek_count):
+        seek_position = random_generator.uniform(0.5, min(len(reference) / sample_rate, engine.song_length) - 1.5)
+        run_for(scheduler, 0.2)
+        engine.pause()
+        run_for(scheduler, 0.2)
+        capture_offset = os.path.getsize(capture_path)
+        seek_start = time.perf_counter()
+        engine.seek(seek_position)
+        seek_times.append(time.perf_counter() - seek_start)
+        engine.resume()
+        run_for(scheduler, 0.5)
+        captured = np.fromfile(capture_path, dtype=np.int16, offset=capture_offset)
+        captured = captured[:len(captured) - len(captured) % channel_count].reshape(-1, channel_count)[:, 0]
+        sound_frames = np.flatnonzero(captured)
+        if len(sound_frames) == 0 or len(captured) - sound_frames[0] < segment_frames:
+            print(f"Warning: no audio recorded after seeking {file_name} to {seek_position:.2f}s")
+            continue
+        segment = captured[sound_frames[0]:sound_frames[0] + segment_frames].astype(np.float64)
+        search_start = max(0, int((seek_position - 1.5) * sample_rate))
+        search_window = reference[search_start:int((seek_position + 1.5) * sample_rate) + segment_frames]
+        transform_size = len(search_window) + segment_frames
+        correlation = np.fft.irfft(np.fft.rfft(search_window, transform_size) *
+                                   np.conj(np.fft.rfft(segment, transform_size)), transform_size)
+        found_frame = search_start + int(np.argmax(correlation[:len(search_window) - segment_frames + 1]))
+        seek_errors.append(abs(found_frame / sample_rate - seek_position))
+    engine.pause()
+    metric_prefix = f"seek_{os.path.splitext(file_name)[1][1:]}"
+    results = {f"{metric_prefix}_median_seconds": statistics.median(seek_times)}
+    if seek_errors:
+        results[f"{metric_prefix}_error_max_seconds"] = max(seek_errors)
+    return results
+
+def get_tone_windows(captured, sample_rate, window_seconds=0.02):
+    # Names each window of a recording by the nearest generated tone, from its zero crossing rate. Windows that are
+    # partly silent are None, as the silence would pull their rate towards the lowest tone.
+    import numpy as np
+    window_frames = int(sample_rate * window_seconds)
+    frequencies = [frequency for _, _, frequency in GAP_TONES]
+    tone_windows = []
+    for window_start in range(0, len(captured) - window_frames + 1, window_frames):
+        window = captured[window_start:window_start + window_frames]
+        loud_samples = np.abs(window) >= 16
+        if np.count_nonzero(loud_samples) < 0.9 * window_frames:
+            tone_windows.append(None)
+            continue
+        signs = np.signbit(window[loud_samples])
+        crossing_rate = np.count_nonzero(signs[1:] != signs[:-1]) / window_seconds / 2
+        tone_windows.append(min(frequencies, key=lambda frequency: abs(frequency - crossing_rate)))
+    return tone_windows, window_frames
+
+def measure_gap(captured, sample_rate, tone_windows, window_frames, previous_frequency, next_frequency):
+    # The longest silent stretch between the last window of one tone and the first window of the next.
+    import numpy as np
+    try:
+        last_window = len(tone_windows) - 1 - tone_windows[::-1].index(previous_frequency)
+        first_window = tone_windows.index(next_frequency, last_window)
+    except ValueError:
+        return None
+    between = np.abs(captured[last_window * window_frames:(first_window + 1) * window_frames]) < 16
+    longest_run = current_run = 0
+    for is_silent in between:
+        current_run = current_run + 1 if is_silent else 0
+        longest_run = max(longest_run, current_run)
+    return longest_run / sample_rate
+
+def benchmark_gap(format_path, capture_path):
+    # Plays two tones from one folder through the gapless queue, opens a second folder while the second tone
+    # plays, and records the output with SDL's disk driver. The gaps are the silence heard at each hand-over;
+    # after the folder switch the new folder's first tone has to follow.
+    os.environ["SDL_AUDIODRIVER"] = "disk"
+    os.environ["SDL_DISKAUDIOFILE"] = capture_path
+    import numpy as np
+    Cringeamp.init_mixer()
+    sample_rate, sample_format, channel_count = Cringeamp.pygame.mixer.get_init()
+    if sample_format != -16:
+        print(f"Skipping gap benchmark: the mixer plays {sample_format}-bit audio, not 16-bit")
+        return {}
+    scheduler = BenchmarkScheduler()
+    engine = Cringeamp.PlaybackEngine(scheduler)
+    engine.normalise_loudness = False
+    first_frequency, second_frequency, next_folder_frequency = (frequency for _, _, frequency in GAP_TONES)
+
+    def run_playing(condition):
+        run_until(scheduler, lambda: (engine.delayed_start_pending or not engine.playback_active or engine.update())
+                  and condition())
+
+    engine.load_folder(os.path.join(format_path, "first"))
+    run_until(scheduler, lambda: engine.scanner is None)
+    engine.play_index(0)
+    run_playing(lambda: engine.current_index == 1)
+    engine.load_folder(os.path.join(format_path, "second"))
+    run_playing(lambda: engine.current_index_selected)
+    run_for(scheduler, 0.5)
+    engine.pause()
+    captured = np.fromfile(capture_path, dtype=np.int16)
+    captured = captured[:len(captured) - len(captured) % channel_count].reshape(-1, channel_count)[:, 0]
+    tone_windows, window_frames = get_tone_windows(captured, sample_rate)
+    metric_prefix = f"gap_{os.path.basename(format_path)}"
+    results = {}
+    track_gap = measure_gap(captured, sample_rate, tone_windows, window_frames, first_frequency, second_frequency)
+    if track_gap is not None:
+        results[f"{metric_prefix}_seconds"] = track_gap
+    folder_gap = measure_gap(captured, sample_rate, tone_windows, window_frames, second_frequency, next_folder_frequency)
+    if folder_gap is not None:
+        results[f"{metric_prefix}_folder_switch_seconds"] = folder_gap
+    else:
+        print(f"Warning: the new folder's first track did not follow in {metric_prefix}")
+    return results
+
+def get_synthetic_track_info(track_index):
+    # Scanner output for a made-up Artist/Album/track library, built on demand so only the player keeps it.
+    folder_index = track_index // 12
+    file_name = f"{track_index % 12 + 1:02d} - Song {track_index:06d}.flac"
+    full_path = os.path.join(os.sep, "music", f"Artist {folder_index // 10:04d}", f"Album {folder_index:05d}", file_name)
+    return (full_path, f"▶ Artist {folder_index // 10:04d} - Song {track_index:06d}",
+            Cringeamp.PlaybackEngine.track_sort_key(file_name), 180.0 + track_index % 120,
+            -6.5 if track_index % 3 == 0 else None)
+
+def benchmark_playlist_size(track_count, storage, seed):
+    # Inserts a synthetic library in scanner batches, folder by folder with each folder's tracks out of order.
+    # "lists" keeps the same tracks the way the player used to, see below.
+    random_generator = random.Random(seed)
+    track_order = array("I", sorted(range(track_count), key=lambda track_index: (track_index // 12, random_generator.random())))
+    start_rss_mb = get_memory_status_mb("VmRSS")
+    insert_start = time.perf_counter()
+    if storage == "engine":
+        engine = Cringeamp.PlaybackEngine(BenchmarkScheduler())
+        engine.library_folder = os.path.join(os.sep, "music")
+        for batch_start in range(0, track_count, SCAN_BATCH_SIZE):
+            engine.add_scanned_tracks([get_synthetic_track_info(track_index)
+                                       for track_index in track_order[batch_start:batch_start + SCAN_BATCH_SIZE]])
+    else:
+        # The previous layout: one sort key, path and title per track, kept ordered with a bisect and list insert
+        # per track, and path-keyed dictionaries for lengths and gains.
+        library_folder = os.path.join(os.sep, "music")
+        track_sort_keys, playlist, track_titles = [], [], []
+        track_lengths, track_gains, group_keys = {}, {}, {}
+        for track_index in track_order:
+            full_path, display_title, sort_key, track_length, track_gain = get_synthetic_track_info(track_index)
+            track_lengths[full_path] = track_length
+            if track_gain is not None:
+                track_gains[full_path] = track_gain
+            relative_directory = os.path.relpath(os.path.dirname(full_path), library_folder)
+            group_key = tuple(part.lower() for part in relative_directory.split(os.sep))
+            group_key = group_keys.setdefault(group_key, group_key)
+            playlist_key = (group_key, sort_key)
+            insert_index = bisect.bisect_right(track_sort_keys, playlist_key)
+            track_sort_keys.insert(insert_index, playlist_key)
+            playlist.insert(insert_index, full_path)
+            track_titles.insert(insert_index, display_title[2:])
+    metric_prefix = f"playlist_{track_count}_{storage}"
+    results = {f"{metric_prefix}_insert_seconds": time.perf_counter() - insert_start}
+    end_rss_mb = get_memory_status_mb("VmRSS")
+    if start_rss_mb is not None and end_rss_mb is not None:
+        results[f"{metric_prefix}_rss_mb"] = end_rss_mb - start_rss_mb
+    if storage == "engine":
+        results.update(benchmark_search(engine, track_count))
+    return results
+
+def benchmark_search(engine, track_count):
+    # Times what the search box does per keystroke: pick the candidates and check the first chunk of them.
+    # The rest of a large result set is filled in from idle callbacks, so it does not count against typing.
+    index_start = time.perf_counter()
+    search_index = Cringeamp.SearchIndex(list(engine.track_titles), list(engine.playlist.file_names))
+    while not search_index.is_ready():
+        time.sleep(0.001)
+    results = {f"search_{track_count}_index_seconds": time.perf_counter() - index_start}
+    keystroke_times = []
+    for query_length in range(1, len(SEARCH_QUERY) + 1):
+        keystroke_start = time.perf_counter()
+        search_query = search_index.search(SEARCH_QUERY[:query_length])
+        search_query.advance()
+        keystroke_times.append(time.perf_counter() - keystroke_start)
+        while not search_query.is_complete():
+            search_query.advance()
+    if not search_query.results:
+        print(f"Warning: searching {track_count} tracks for {SEARCH_QUERY!r} found nothing")
+    results[f"search_{track_count}_keystroke_max_seconds"] = max(keystroke_times)
+    return results
+
+def send_control_request(control_socket, request):
+    request_start = time.perf_counter()
+    control_socket.sendall(json.dumps(request).encode() + b"\n")
+    response_data = b""
+    while not response_data.endswith(b"\n"):
+        received_data = control_socket.recv(65536)
+        if not received_data:
+            raise RuntimeError(f"Headless check: the daemon closed the socket after {request}")
+        response_data += received_data
+    return json.loads(response_data), time.perf_counter() - request_start
+
+def check_headless(folder_path, working_directory):
+    # Starts `Cringeamp.py --headless` on a temporary socket with the dummy audio driver and its own cache, drives
+    # it the way a client would and checks every reply. Any wrong reply fails the run.
+    if not hasattr(socket, "AF_UNIX"):
+        print("Skipping headless check: this platform has no Unix domain sockets")
+        return {}
+    socket_path = os.path.join(working_directory, "control.sock")
+    daemon_environment = dict(os.environ, SDL_AUDIODRIVER="dummy",
+                              XDG_CACHE_HOME=os.path.join(working_directory, "headless-cache"))
+    daemon = subprocess.Popen([sys.executable, os.path.abspath(Cringeamp.__file__), "--headless", "--socket", socket_path],
+                              env=daemon_environment, stdout=subprocess.DEVNULL)
+    request_times = []
+    try:
+        start_time = time.perf_counter()
+        while not os.path.exists(socket_path):
+            if daemon.poll() is not None:
+                raise RuntimeError(f"Headless check: the daemon exited with code {daemon.returncode}")
+            if time.perf_counter() - start_time > 30:
+                raise TimeoutError("Headless check: the daemon did not open its socket")
+            time.sleep(0.05)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as control_socket:
+            control_socket.settimeout(10)
+            control_socket.connect(socket_path)
+
+            def request(command, expected_description, condition, **fields):
+                response, request_seconds = send_control_request(control_socket, dict(fields, command=command))
+                request_times.append(request_seconds)
+                if not condition(response):
+                    raise RuntimeError(f"Headless check: expected {command} to {expected_description}, got {response}")
+                return response
+
+            request("status", "report an empty, stopped player",
+                    lambda response: response["ok"] and response["state"] == "stopped" and response["tracks"] == 0)
+            request("load", "accept the folder", lambda response: response["ok"], folder=folder_path)
+            start_time = time.perf_counter()
+            while request("status", "succeed", lambda response: response["ok"])["scanning"]:
+                if time.perf_counter() - start_time > 30:
+                    raise TimeoutError("Headless check: the scan did not finish")
+                time.sleep(0.05)
+            request("status", "list both tracks", lambda response: response["tracks"] == 2)
+            request("play", "start the first track",
+                    lambda response: response["state"] == "playing" and response["index"] == 0, index=0)
+            request("seek", "move into the track", lambda response: abs(response["position"] - 0.5) < 0.3, position=0.5)
+            # The seek came in before the delayed start, so the track has to start from where it was moved to.
+            time.sleep(0.3)
+            request("status", "keep playing from the seek position",
+                    lambda response: response["state"] == "playing" and response["index"] == 0 and
+                    response["position"] >= 0.5)
+            request("next", "start the second track",
+                    lambda response: response["state"] == "playing" and response["index"] == 1)
+            request("play", "refuse a missing track", lambda response: not response["ok"], index=2)
+            request("rewind", "be refused", lambda response: not response["ok"])
+            request("pause", "pause playback", lambda response: response["state"] == "paused")
+    finally:
+        daemon.terminate()
+        try:
+            daemon.wait(10)
+        except subprocess.TimeoutExpired:
+            daemon.kill()
+            daemon.wait()
+    if daemon.returncode != 0:
+        raise RuntimeError(f"Headless check: the daemon exited with code {daemon.returncode} when stopped")
+    if os.path.exists(socket_path):
+        raise RuntimeError("Headless check: the daemon left its socket behind")
+    return {"headless_request_max_seconds": max(request_times)}
+
+def get_metric_names(metrics):
+    # The fixed metrics first, then the per-format and per-size ones in a stable order.
+    return [metric_name for metric_name in METRIC_NAMES if metric_name in metrics] + \
+        sorted(metric_name for metric_name in metrics if metric_name not in METRIC_NAMES)
+
+def compare_with_baseline(results, baseline, tolerance):
+    if baseline.get("configuration") != results["configuration"]:
+        print("Warning: baseline was recorded with a different configuration")
+    regressions = []
+    for metric_name in get_metric_names(results["metrics"]):
+        current_value = results["metrics"].get(metric_name)
+        baseline_value = baseline["metrics"].get(metric_name)
+        if current_value is None or not baseline_value:
+            continue
+        ratio = current_value / baseline_value
+        marker = ""
+        if ratio > 1 + tolerance:
+            marker = "  REGRESSION"
+            regressions.append(metric_name)
+        print(f"{metric_name:40} {baseline_value:10.4f} -> {current_value:10.4f} ({(ratio - 1) * 100:+.1f}%){marker}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Cringeamp against a synthetic music library.")
+    parser.add_argument("--folders", type=int, default=20, help="number of album folders to generate")
+    parser.add_argument("--tracks", type=int, default=12, help="tracks per folder")
+    parser.add_argument("--depth", type=int, default=2, choices=range(1, 9), metavar="1-8",
+                        help="folder levels below the library root")
+    parser.add_argument("--formats", default="wav,flac,mp3", help="comma separated formats to generate")
+    parser.add_argument("--seconds", type=float, default=1.0, help="length of each generated track")
+    parser.add_argument("--corpus-seconds", type=float, default=60.0,
+                        help="length of the per-format tones used for the track length comparison")
+    parser.add_argument("--playlist-sizes", default="1000,10000,100000",
+                        help="comma separated track counts for the playlist insert time and memory benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--switches", type=int, default=10, help="track switches to time")
+    parser.add_argument("--seeks", type=int, default=5, help="seeks to time and check per format")
+    parser.add_argument("--library", help="generate into this folder and keep it instead of using a temporary one")
+    parser.add_argument("--gui", action="store_true", help="drive the full Tk window, e.g. under xvfb-run")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against results saved with --save-baseline")
+    parser.add_argument("--save-baseline", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    arguments = parser.parse_args()
+
+    formats = [file_format.strip().lower() for file_format in arguments.formats.split(",") if file_format.strip()]
+    if "ogg" in formats:
+        # There is no Vorbis encoder among the player's dependencies to make real OGG files with.
+        print("Skipping ogg: no Vorbis encoder is available")
+        formats.remove("ogg")
+    if "mp3" in formats and importlib.util.find_spec("lameenc") is None:
+        print("Skipping mp3: install lameenc to generate MP3 files")
+        formats.remove("mp3")
+    if not formats:
+        parser.error("no generatable formats selected")
+    if arguments.corpus_seconds < 3:
+        parser.error("--corpus-seconds must be at least 3 to leave room for seeking")
+    try:
+        playlist_sizes = [int(track_count) for track_count in arguments.playlist_sizes.split(",") if track_count.strip()]
+    except ValueError:
+        parser.error("--playlist-sizes takes whole numbers")
+
+    working_directory = tempfile.mkdtemp(prefix="cringeamp-benchmark-")
+    cache_directory = os.path.join(working_directory, "cache")
+    os.makedirs(cache_directory)
+    # Every run starts with an empty library index so the cold scan really is cold.
+    library_path = os.path.abspath(arguments.library) if arguments.library else os.path.join(working_directory, "library")
+    try:
+        generate_start = time.perf_counter()
+        file_count = generate_library(library_path, arguments.folders, arguments.tracks, arguments.depth, formats,
+                                      arguments.seconds, arguments.seed)
+        corpus_path = os.path.join(working_directory, "corpus")
+        generate_format_corpus(corpus_path, formats, arguments.corpus_seconds, arguments.seed)
+        print(f"Generated {file_count} files in {time.perf_counter() - generate_start:.1f}s")
+        metrics = run_in_fresh_process(cache_directory, benchmark_player, library_path, file_count, arguments.switches,
+                                       arguments.gui)
+        metrics.update(run_in_fresh_process(cache_directory, benchmark_sort, library_path, arguments.seed))
+        for track_count in playlist_sizes:
+            for storage in ("engine", "lists"):
+                metrics.update(run_in_fresh_process(cache_directory, benchmark_playlist_size, track_count, storage,
+                                                    arguments.seed))
+        for file_format in formats:
+            for length_source in ("header", "decode"):
+                metrics.update(run_in_fresh_process(cache_directory, benchmark_track_length,
+                                                    os.path.join(corpus_path, file_format), length_source))
+            metrics.update(run_in_fresh_process(cache_directory, benchmark_gap, os.path.join(corpus_path, "gap", file_format),
+                                                os.path.join(working_directory, f"gap-{file_format}.raw")))
+            if arguments.seeks > 0:
+                metrics.update(run_in_fresh_process(cache_directory, benchmark_seek,
+                                                    os.path.join(corpus_path, "seek", f"Noise.{file_format}"),
+                                                    os.path.join(working_directory, f"capture-{file_format}.raw"),
+                                                    arguments.seeks, arguments.seed))
+        metrics.update(check_headless(os.path.join(corpus_path, "gap", formats[0], "first"), working_directory))
+    finally:
+        shutil.rmtree(working_directory, ignore_errors=True)
+
+    results = {
+        "configuration": {
+            "folders": arguments.folders, "tracks": arguments.tracks, "depth": arguments.depth, "formats": formats,
+            "seconds": arguments.seconds, "corpus_seconds": arguments.corpus_seconds,
+            "playlist_sizes": playlist_sizes, "seed": arguments.seed, "switches": arguments.switches, "seeks": arguments.seeks,
+            "gui": arguments.gui,
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "metrics": metrics,
+    }
+    for metric_name in get_metric_names(metrics):
+        print(f"{metric_name:40} {metrics[metric_name]:10.4f}")
+    for output_path in (arguments.output, arguments.save_baseline):
+        if output_path:
+            with open(output_path, "w") as output_file:
+                json.dump(results, output_file, indent=2)
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_with_baseline(results, baseline, arguments.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {arguments.tolerance * 100:.0f}%")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()